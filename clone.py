@@ -1,9 +1,16 @@
 import git
 import os
 
+# Fetch only the current tree; history is never read
+CLONE_OPTIONS = ["--depth=1", "--filter=blob:none", "--single-branch"]
+
 def clone_repo(repo_url, clone_dir):
     """
     Clone a GitHub repo into a given directory.
+
+    Only the latest snapshot of the default branch is fetched (shallow,
+    partial clone), so history-dependent git features such as log/blame
+    are unavailable in the clone. Downstream code only reads file contents.
     
     Parameters:
         repo_url (str): GitHub repository URL.
@@ -19,7 +26,7 @@ def clone_repo(repo_url, clone_dir):
         print(f"⚠️ Repo already exists at {target_path}")
     else:
         print(f"⏳ Cloning {repo_url} into {target_path} ...")
-        git.Repo.clone_from(repo_url, target_path)
+        git.Repo.clone_from(repo_url, target_path, multi_options=CLONE_OPTIONS)
         print("✅ Clone complete!")
 
 # Example usage
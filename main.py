@@ -1,10 +1,12 @@
+import asyncio
+import json
 import os
 import shutil
 import uvicorn
 import pandas as pd
 from fastapi import FastAPI, HTTPException, status
 from fastapi.encoders import jsonable_encoder
-from fastapi.responses import JSONResponse, FileResponse
+from fastapi.responses import JSONResponse, FileResponse, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 from pydantic import BaseModel
 import google.generativeai as genai
@@ -16,12 +18,26 @@ from clone import clone_repo
 from file_contents import extract_files_to_csv
 from issues import extract_issues
 from repo_summarizer import summarize_repository
+from repo_cache import (
+    ARTIFACT_FORMAT_VERSION,
+    get_clone_head_sha,
+    get_remote_head_sha,
+    repo_cache_dir,
+    restore_artifacts,
+    store_artifacts,
+)
 from models.gemini_models_rag import (
     load_env_and_configure as load_gemini_env,
     build_vector_index,
     create_prompt,
     retrieve_relevant_files,
+    release_index as release_gemini_index,
     MODEL_NAME as GEMINI_MODEL_NAME,
+    CUSTOM_MODEL_PATH,
+    INDEX_PATH as GEMINI_INDEX_PATH,
+    META_PATH as GEMINI_META_PATH,
+    SNIPPET_CHARS,
+    INDEX_PARAMS as GEMINI_INDEX_PARAMS,
 )
 from models.groq_models_rag import (
     load_env_and_configure as load_groq_env,
@@ -35,6 +51,16 @@ ISSUES_CSV = os.path.join(TEMP_DATA_DIR, "repo_issues.csv")
 INDEX_PATH = os.path.join(TEMP_DATA_DIR, "repo_index.pkl")
 CLONE_DIR = "cloned_repo"
 
+# Artifacts reused across /process-repo calls for the same commit; the manifest
+# records the format and settings they were built with so a change to either invalidates them
+CACHED_ARTIFACTS = [FILES_CSV, GEMINI_INDEX_PATH, GEMINI_META_PATH]
+CACHE_MANIFEST = {
+    "artifact_format": ARTIFACT_FORMAT_VERSION,
+    "embed_model": CUSTOM_MODEL_PATH,
+    "snippet_chars": SNIPPET_CHARS,
+    "gemini_index": GEMINI_INDEX_PARAMS,
+}
+
 # Create temp directory
 os.makedirs(TEMP_DATA_DIR, exist_ok=True)
 
@@ -56,6 +82,7 @@ app = FastAPI()
 # --- Global State ---
 gemini_model = genai.GenerativeModel(GEMINI_MODEL_NAME)
 chat_sessions = {}
+chat_locks = {}  # session key -> asyncio.Lock; a ChatSession takes one message at a time
 
 
 # --- Pydantic Models ---
@@ -83,8 +110,14 @@ def remove_readonly(func, path, exc):
         raise
 
 
+def release_indexes():
+    """Unmaps the loaded index files; Windows refuses to replace or delete a mapped file."""
+    release_gemini_index()
+
+
 def cleanup_temp_data():
     """Removes temporary data files with retry logic for Windows lock issues."""
+    release_indexes()
     max_retries = 3
     retry_count = 0
 
@@ -114,29 +147,38 @@ def cleanup_temp_data():
                 return
 
 
-def load_issue_by_id(csv_path: str, issue_id: int) -> dict | None:
-    """Loads a specific issue from the CSV using its GitHub issue number (id)."""
-    if not os.path.exists(csv_path):
-        return None
+_ISSUES_CACHE = {"path": None, "mtime": None, "df": None}
 
-    df = pd.read_csv(csv_path)
 
-    if 'number' not in df.columns:
+def _load_issues_df(csv_path: str) -> pd.DataFrame | None:
+    """Loads the issues CSV indexed by issue number, reusing it until the file changes."""
+    if not os.path.exists(csv_path):
         return None
 
-    df = df.fillna("")
+    mtime = os.stat(csv_path).st_mtime_ns
+    if _ISSUES_CACHE["path"] != csv_path or _ISSUES_CACHE["mtime"] != mtime:
+        df = pd.read_csv(csv_path)
+        if 'number' in df.columns:
+            df = df.fillna("")
+            df = df.set_index(pd.to_numeric(df['number'], errors='coerce').astype('Int64'))
+            df = df[~df.index.duplicated()]
+        else:
+            df = None
+        _ISSUES_CACHE.update(path=csv_path, mtime=mtime, df=df)
 
-    try:
-        df['number'] = pd.to_numeric(df['number'], errors='coerce')
-    except Exception:
-        pass
+    return _ISSUES_CACHE["df"]
 
-    issue_df = df[df['number'] == issue_id]
 
-    if issue_df.empty:
+def load_issue_by_id(csv_path: str, issue_id: int) -> dict | None:
+    """Loads a specific issue from the CSV using its GitHub issue number (id)."""
+    df = _load_issues_df(csv_path)
+    if df is None:
         return None
 
-    record = issue_df.to_dict(orient="records")[0]
+    try:
+        record = df.loc[issue_id].to_dict()
+    except KeyError:
+        return None
 
     for k, v in record.items():
         if v is None:
@@ -149,6 +191,43 @@ def load_issue_by_id(csv_path: str, issue_id: int) -> dict | None:
     return record
 
 
+# --- Processing Steps (run in worker threads) ---
+def clone_and_extract_files(repo_url: str):
+    """Clones the repository and extracts its files into FILES_CSV."""
+    print(f"Cloning {repo_url}...")
+    clone_repo(repo_url, CLONE_DIR)
+
+    repo_name = repo_url.rstrip("/").split("/")[-1].replace(".git", "")
+    repo_path = os.path.join(CLONE_DIR, repo_name)
+
+    print("📂 Extracting repository files...")
+    extract_files_to_csv(repo_path, FILES_CSV)
+
+    # The commit actually extracted: the branch may have moved since get_remote_head_sha
+    return get_clone_head_sha(repo_path)
+
+
+def build_index_safe():
+    """Builds the vector index, logging (not raising) on failure."""
+    print("🧠 Building vector index...")
+    try:
+        build_vector_index()
+        return True
+    except Exception as e_index:
+        print(f"⚠️ Warning: failed to build vector index: {e_index}")
+        return False
+
+
+def generate_summary_safe(model: str, repo_key: str = None) -> str:
+    """Generates the repository summary, returning a fallback message on failure."""
+    print("📖 Generating repository summary...")
+    try:
+        return summarize_repository(model=model, repo_key=repo_key)
+    except Exception as e_summary:
+        print(f"⚠️ Warning: failed to generate summary: {e_summary}")
+        return "Summary generation failed. Please check API keys."
+
+
 # --- API Endpoint 1: Process Repository ---
 @app.post("/process-repo")
 async def process_repo(request: RepoRequest):
@@ -162,39 +241,52 @@ async def process_repo(request: RepoRequest):
         )
 
     chat_sessions.clear()
+    chat_locks.clear()
     cleanup_temp_data()
 
     token = os.getenv("GITHUB_TOKEN")
 
     try:
-        print(f"Cloning {request.url}...")
-        clone_repo(request.url, CLONE_DIR)
-
-        repo_name = request.url.rstrip("/").split("/")[-1].replace(".git", "")
-        repo_path = os.path.join(CLONE_DIR, repo_name)
-
-        print("📂 Extracting repository files...")
-        extract_files_to_csv(repo_path, FILES_CSV)
-
         print("🐞 Extracting repository issues...")
         if not token:
             print("⚠️ GITHUB_TOKEN not set. May be rate-limited.")
-        extract_issues(request.url, output_file=ISSUES_CSV, token=token)
 
-        print("🧠 Building vector index...")
-        try:
-            build_vector_index()
-        except Exception as e_index:
-            print(f"⚠️ Warning: failed to build vector index: {e_index}")
+        # Reuse files + index built earlier for the same commit; issues are always re-fetched
+        sha = await asyncio.to_thread(get_remote_head_sha, request.url)
+        cache_dir = repo_cache_dir(request.url, sha) if sha else None
+        release_indexes()
+        cached = bool(cache_dir) and await asyncio.to_thread(
+            restore_artifacts, cache_dir, CACHED_ARTIFACTS, CACHE_MANIFEST
+        )
 
-        # NEW: Generate repository summary
-        print("📖 Generating repository summary...")
-        summary = ""
-        try:
-            summary = summarize_repository(model=request.model)
-        except Exception as e_summary:
-            print(f"⚠️ Warning: failed to generate summary: {e_summary}")
-            summary = "Summary generation failed. Please check API keys."
+        if cached:
+            await asyncio.to_thread(extract_issues, request.url, output_file=ISSUES_CSV, token=token)
+            summary = await asyncio.to_thread(generate_summary_safe, request.model, f"{request.url}@{sha}")
+        else:
+            # Cloning and the GitHub issues API are independent, so overlap them
+            clone_sha, _ = await asyncio.gather(
+                asyncio.to_thread(clone_and_extract_files, request.url),
+                asyncio.to_thread(extract_issues, request.url, output_file=ISSUES_CSV, token=token),
+            )
+
+            # The summary only reads the CSVs, so it can run while the index is built
+            index_built, summary = await asyncio.gather(
+                asyncio.to_thread(build_index_safe),
+                asyncio.to_thread(generate_summary_safe, request.model,
+                                  f"{request.url}@{clone_sha}" if clone_sha else None),
+            )
+
+            # Stored under the cloned commit, so a push between ls-remote and clone can't
+            # file one commit's index under another's SHA
+            if sha and clone_sha and clone_sha != sha:
+                print(f"⚠️ Remote HEAD moved to {clone_sha[:12]} during processing; caching under the cloned commit")
+            if index_built and clone_sha:
+                try:
+                    await asyncio.to_thread(
+                        store_artifacts, repo_cache_dir(request.url, clone_sha), CACHED_ARTIFACTS, CACHE_MANIFEST
+                    )
+                except Exception as e_cache:
+                    print(f"⚠️ Warning: failed to cache repo artifacts: {e_cache}")
 
         print("✅ Processing complete.")
         if not os.path.exists(ISSUES_CSV):
@@ -210,10 +302,8 @@ async def process_repo(request: RepoRequest):
 
         issues_df_subset = df_issues[['id', 'title', 'body']].copy()
 
-        for col in ['id', 'title', 'body']:
-            issues_df_subset[col] = issues_df_subset[col].apply(
-                lambda v: "" if v is None else (str(v) if not isinstance(v, (str, int, bool, list, dict)) else v)
-            )
+        issues_df_subset['id'] = pd.to_numeric(issues_df_subset['id'], errors='coerce').fillna(0).astype(int)
+        issues_df_subset[['title', 'body']] = issues_df_subset[['title', 'body']].astype(str)
 
         issues_list = issues_df_subset.to_dict(orient="records")
 
@@ -233,41 +323,69 @@ async def process_repo(request: RepoRequest):
         )
 
 
-# --- API Endpoint 2: Chat with AI ---
-@app.post("/ask-ai")
-async def ask_ai(request: AiRequest):
-    """Handles chat using selected model (Gemini or Groq)."""
-    print(f"🤖 Chat request (model: {request.model}) for issue {request.issue_id}")
+# --- Chat Session Helper ---
+def get_chat_session(request: AiRequest):
+    """Returns the chat session for an issue/model pair, creating it on first use."""
+    session_key = f"{request.issue_id}_{request.model}"
 
-    if request.model not in ["gemini", "groq"]:
-        raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail="Model must be 'gemini' or 'groq'"
+    if session_key not in chat_sessions:
+        print(f"Creating new chat session for issue {request.issue_id} ({request.model})...")
+
+        issue = load_issue_by_id(ISSUES_CSV, request.issue_id)
+        if issue is None:
+            raise HTTPException(status_code=404, detail="Selected issue not found.")
+
+        print("Retrieving relevant files...")
+        repo_context = retrieve_relevant_files(issue.get("body", ""))
+        system_prompt = create_prompt(issue, repo_context)
+
+        chat = gemini_model.start_chat(
+            history=[{"role": "user", "parts": system_prompt}]
         )
+        chat_sessions[session_key] = chat
 
+    return chat_sessions[session_key]
+
+
+def settle_chat_stream(request: AiRequest, response):
+    """Finishes an interrupted Gemini stream so its ChatSession can send again, else drops the session."""
     try:
-        session_key = f"{request.issue_id}_{request.model}"
+        response.resolve()
+    except Exception as e:
+        print(f"⚠️ Dropping chat session for issue {request.issue_id} after a broken stream: {e}")
+        chat_sessions.pop(f"{request.issue_id}_{request.model}", None)
 
-        if session_key not in chat_sessions:
-            print(f"Creating new chat session for issue {request.issue_id} ({request.model})...")
 
-            issue = load_issue_by_id(ISSUES_CSV, request.issue_id)
-            if issue is None:
-                raise HTTPException(status_code=404, detail="Selected issue not found.")
+def get_session_lock(request: AiRequest) -> asyncio.Lock:
+    """Lock serializing sends (and stream settling) on one chat session."""
+    return chat_locks.setdefault(f"{request.issue_id}_{request.model}", asyncio.Lock())
 
-            print("Retrieving relevant files...")
-            repo_context = retrieve_relevant_files(issue.get("body", ""))
-            system_prompt = create_prompt(issue, repo_context)
 
-            chat = gemini_model.start_chat(
-                history=[{"role": "user", "parts": system_prompt}]
-            )
-            chat_sessions[session_key] = chat
+def validate_model(model: str):
+    """Rejects requests for models other than 'gemini' or 'groq'."""
+    if model not in ["gemini", "groq"]:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Model must be 'gemini' or 'groq'"
+        )
+
+
+# --- API Endpoint 2: Chat with AI ---
+@app.post("/ask-ai")
+async def ask_ai(request: AiRequest):
+    """Handles chat using selected model (Gemini or Groq)."""
+    print(f"🤖 Chat request (model: {request.model}) for issue {request.issue_id}")
 
-        chat = chat_sessions[session_key]
+    validate_model(request.model)
+
+    try:
+        # Retrieval (encode + FAISS) and the LLM call are blocking; keep them off the event loop
+        chat = await asyncio.to_thread(get_chat_session, request)
 
         print(f"Sending prompt to {request.model}...")
-        response = chat.send_message(request.prompt)
+        # to_thread lets two requests reach one ChatSession at once; it is not thread-safe
+        async with get_session_lock(request):
+            response = await asyncio.to_thread(chat.send_message, request.prompt)
         response_text = response.text
 
         print(f"✅ Got response from {request.model}")
@@ -281,6 +399,64 @@ async def ask_ai(request: AiRequest):
         )
 
 
+def sse_event(payload: dict) -> str:
+    """Formats a payload as a Server-Sent Events frame."""
+    return f"data: {json.dumps(payload)}\n\n"
+
+
+# --- API Endpoint 2b: Chat with AI (streamed) ---
+@app.post("/ask-ai/stream")
+async def ask_ai_stream(request: AiRequest):
+    """Same as /ask-ai, but streams the reply as SSE `data: {"delta": ...}` frames."""
+    print(f"🤖 Streaming chat request (model: {request.model}) for issue {request.issue_id}")
+
+    validate_model(request.model)
+
+    try:
+        chat = await asyncio.to_thread(get_chat_session, request)
+    except HTTPException:
+        raise
+    except Exception as e:
+        print(f"❌ Error during AI chat: {e}")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"An error occurred with the AI model: {str(e)}"
+        )
+
+    loop = asyncio.get_running_loop()
+    session_lock = get_session_lock(request)
+
+    def event_stream():
+        # Sync generator: Starlette iterates it in a threadpool, off the event loop
+        response = None
+        completed = False
+        locked = False
+        try:
+            # Held until the reply is fully read or settled, so no other send overlaps it
+            asyncio.run_coroutine_threadsafe(session_lock.acquire(), loop).result()
+            locked = True
+            print(f"Streaming prompt to {request.model}...")
+            response = chat.send_message(request.prompt, stream=True)
+            for chunk in response:
+                if chunk.parts:  # the closing chunk may carry only the finish reason
+                    yield sse_event({"delta": chunk.text})
+            completed = True
+
+            print(f"✅ Streamed response from {request.model}")
+            yield sse_event({"done": True})
+        except Exception as e:
+            print(f"❌ Error during AI chat stream: {e}")
+            yield sse_event({"error": f"An error occurred with the AI model: {str(e)}"})
+        finally:
+            # Runs on errors and on client disconnect (generator closed mid-stream)
+            if response is not None and not completed:
+                settle_chat_stream(request, response)
+            if locked:
+                loop.call_soon_threadsafe(session_lock.release)
+
+    return StreamingResponse(event_stream(), media_type="text/event-stream")
+
+
 # --- API Endpoint 3: Get Available Models ---
 @app.get("/models")
 async def get_models():
@@ -299,6 +475,7 @@ async def cleanup():
     """Cleanup temporary data."""
     cleanup_temp_data()
     chat_sessions.clear()
+    chat_locks.clear()
     return {"message": "Cleanup complete"}
 
 
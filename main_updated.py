@@ -1,11 +1,13 @@
 # main.py
+import asyncio
+import json
 import os
 import shutil
 import uvicorn
 import pandas as pd
 from fastapi import FastAPI, HTTPException, status
 from fastapi.encoders import jsonable_encoder
-from fastapi.responses import JSONResponse, FileResponse
+from fastapi.responses import JSONResponse, FileResponse, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 from pydantic import BaseModel
 from fastapi.middleware.cors import CORSMiddleware
@@ -20,13 +22,28 @@ from issues import extract_issues
 # Add summarizer import (new)
 from repo_summarizer import summarize_repository
 
+# Per-commit artifact cache for /process-repo
+from repo_cache import (
+    ARTIFACT_FORMAT_VERSION,
+    get_clone_head_sha,
+    get_remote_head_sha,
+    repo_cache_dir,
+    restore_artifacts,
+    store_artifacts,
+)
+
 # Gemini RAG model helpers (keep names distinct)
 from models.gemini_models_rag import (
     load_env_and_configure as load_gemini_env,
     build_vector_index as build_gemini_index,
     create_prompt as create_gemini_prompt,
     retrieve_relevant_files as retrieve_gemini_files,
+    release_index as release_gemini_index,
     MODEL_NAME as GEMINI_MODEL_NAME,
+    INDEX_PATH as GEMINI_INDEX_PATH,
+    META_PATH as GEMINI_META_PATH,
+    SNIPPET_CHARS,
+    INDEX_PARAMS as GEMINI_INDEX_PARAMS,
 )
 
 # Groq (updated chunked RAG) helpers
@@ -35,9 +52,16 @@ from models.groq_model_using_chunks import (
     build_vector_index as build_groq_index,
     create_prompt as create_groq_prompt,
     retrieve_relevant_files as retrieve_groq_files,
+    release_index as release_groq_index,
     MODEL_NAME as GROQ_MODEL_NAME,
     TokenRateLimiter,
     count_tokens as count_tokens_groq,
+    CUSTOM_MODEL_PATH,
+    CHUNK_MAX_TOKENS,
+    CHUNK_OVERLAP_TOKENS,
+    INDEX_PATH as GROQ_INDEX_PATH,
+    CHUNKS_PATH as GROQ_CHUNKS_PATH,
+    INDEX_PARAMS as GROQ_INDEX_PARAMS,
 )
 
 
@@ -49,6 +73,19 @@ ISSUES_CSV = os.path.join(TEMP_DATA_DIR, "repo_issues.csv")
 INDEX_PATH = os.path.join(TEMP_DATA_DIR, "repo_index.pkl")
 CLONE_DIR = "cloned_repo"
 
+# artifacts reused across /process-repo calls for the same commit SHA;
+# the manifest invalidates them when the artifact format or embedding/chunking/index settings change
+CACHED_ARTIFACTS = [FILES_CSV, GEMINI_INDEX_PATH, GEMINI_META_PATH, GROQ_INDEX_PATH, GROQ_CHUNKS_PATH]
+CACHE_MANIFEST = {
+    "artifact_format": ARTIFACT_FORMAT_VERSION,
+    "embed_model": CUSTOM_MODEL_PATH,
+    "snippet_chars": SNIPPET_CHARS,
+    "gemini_index": GEMINI_INDEX_PARAMS,
+    "groq_index": GROQ_INDEX_PARAMS,
+    "chunk_max_tokens": CHUNK_MAX_TOKENS,
+    "chunk_overlap_tokens": CHUNK_OVERLAP_TOKENS,
+}
+
 # Ensure temp dir exists
 os.makedirs(TEMP_DATA_DIR, exist_ok=True)
 
@@ -80,6 +117,7 @@ app.add_middleware(
 # Global state
 gemini_model = genai.GenerativeModel(GEMINI_MODEL_NAME)
 chat_sessions: dict = {}
+chat_locks: dict = {}  # session key -> asyncio.Lock; a Gemini ChatSession takes one message at a time
 # single token limiter instance for Groq TPM guarding (optional)
 token_limiter = TokenRateLimiter()
 
@@ -104,8 +142,15 @@ def remove_readonly(func, path, exc):
         raise
 
 
+# Unmap loaded indexes/chunk tables: Windows refuses to replace or delete a mapped file
+def release_indexes():
+    release_gemini_index()
+    release_groq_index()
+
+
 # Cleanup helper with retries
 def cleanup_temp_data():
+    release_indexes()
     max_retries = 3
     retry_count = 0
     while retry_count < max_retries:
@@ -133,27 +178,39 @@ def cleanup_temp_data():
                 return
 
 
-# Load issue by GitHub issue number (safe coercions)
-def load_issue_by_id(csv_path: str, issue_id: int) -> dict | None:
+# Issues CSV cache: parsed + indexed by issue number once per file version
+_ISSUES_CACHE = {"path": None, "mtime": None, "df": None}
+
+
+def _load_issues_df(csv_path: str) -> pd.DataFrame | None:
     if not os.path.exists(csv_path):
         return None
 
-    df = pd.read_csv(csv_path)
-    if 'number' not in df.columns:
-        return None
+    mtime = os.stat(csv_path).st_mtime_ns
+    if _ISSUES_CACHE["path"] != csv_path or _ISSUES_CACHE["mtime"] != mtime:
+        df = pd.read_csv(csv_path)
+        if 'number' in df.columns:
+            df = df.fillna("")
+            df = df.set_index(pd.to_numeric(df['number'], errors='coerce').astype('Int64'))
+            df = df[~df.index.duplicated()]
+        else:
+            df = None
+        _ISSUES_CACHE.update(path=csv_path, mtime=mtime, df=df)
 
-    df = df.fillna("")
+    return _ISSUES_CACHE["df"]
 
-    try:
-        df['number'] = pd.to_numeric(df['number'], errors='coerce')
-    except Exception:
-        pass
 
-    issue_df = df[df['number'] == issue_id]
-    if issue_df.empty:
+# Load issue by GitHub issue number (safe coercions)
+def load_issue_by_id(csv_path: str, issue_id: int) -> dict | None:
+    df = _load_issues_df(csv_path)
+    if df is None:
+        return None
+
+    try:
+        record = df.loc[issue_id].to_dict()
+    except KeyError:
         return None
 
-    record = issue_df.to_dict(orient="records")[0]
     for k, v in record.items():
         if v is None:
             record[k] = ""
@@ -164,6 +221,53 @@ def load_issue_by_id(csv_path: str, issue_id: int) -> dict | None:
     return record
 
 
+# Processing steps for /process-repo (each runs in a worker thread)
+def clone_and_extract_files(repo_url: str):
+    print(f"Cloning {repo_url}...")
+    clone_repo(repo_url, CLONE_DIR)
+
+    repo_name = repo_url.rstrip("/").split("/")[-1].replace(".git", "")
+    repo_path = os.path.join(CLONE_DIR, repo_name)
+
+    print("📂 Extracting repository files...")
+    extract_files_to_csv(repo_path, FILES_CSV)
+
+    # The commit actually extracted: the branch may have moved since get_remote_head_sha
+    return get_clone_head_sha(repo_path)
+
+
+def build_indexes_safe():
+    print("🧠 Building vector indexes...")
+    built = True
+    # build gemini index (if available)
+    try:
+        build_gemini_index()
+        print("✅ Gemini index built.")
+    except Exception as e_index:
+        built = False
+        print(f"⚠️ Warning: failed to build Gemini index: {e_index}")
+
+    # build groq index (chunked)
+    try:
+        build_groq_index()
+        print("✅ Groq chunked index built.")
+    except Exception as e_index:
+        built = False
+        print(f"⚠️ Warning: failed to build Groq index: {e_index}")
+    return built
+
+
+def generate_summary_safe(model: str, repo_key: str = None) -> str:
+    print("📖 Generating repository summary...")
+    try:
+        summary = summarize_repository(model=model, repo_key=repo_key)
+        print("✅ Repository summary generated.")
+        return summary
+    except Exception as e_summary:
+        print(f"⚠️ Warning: failed to generate repository summary: {e_summary}")
+        return "Summary generation failed. Please check API keys and repo contents."
+
+
 # API: process repo (clone, extract, index, summarize)
 @app.post("/process-repo")
 async def process_repo(request: RepoRequest):
@@ -173,50 +277,53 @@ async def process_repo(request: RepoRequest):
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Model must be 'gemini' or 'groq'")
 
     chat_sessions.clear()
+    chat_locks.clear()
     cleanup_temp_data()
 
     token = os.getenv("GITHUB_TOKEN")
 
     try:
-        print(f"Cloning {request.url}...")
-        clone_repo(request.url, CLONE_DIR)
-
-        repo_name = request.url.rstrip("/").split("/")[-1].replace(".git", "")
-        repo_path = os.path.join(CLONE_DIR, repo_name)
-
-        print("📂 Extracting repository files...")
-        extract_files_to_csv(repo_path, FILES_CSV)
-
         print("🐞 Extracting repository issues...")
         if not token:
             print("⚠️ GITHUB_TOKEN not set. May be rate-limited.")
-        extract_issues(request.url, output_file=ISSUES_CSV, token=token)
 
-        print("🧠 Building vector indexes...")
-        # build gemini index (if available)
-        try:
-            build_gemini_index()
-            print("✅ Gemini index built.")
-        except Exception as e_index:
-            print(f"⚠️ Warning: failed to build Gemini index: {e_index}")
+        # same commit processed before -> restore files CSV + indexes, skip clone/embedding
+        # (issues change independently of commits, so they are always re-fetched)
+        sha = await asyncio.to_thread(get_remote_head_sha, request.url)
+        cache_dir = repo_cache_dir(request.url, sha) if sha else None
+        release_indexes()
+        cached = bool(cache_dir) and await asyncio.to_thread(
+            restore_artifacts, cache_dir, CACHED_ARTIFACTS, CACHE_MANIFEST
+        )
+
+        if cached:
+            await asyncio.to_thread(extract_issues, request.url, output_file=ISSUES_CSV, token=token)
+            summary = await asyncio.to_thread(generate_summary_safe, request.model, f"{request.url}@{sha}")
+        else:
+            # clone/extract and the GitHub issues API are independent -> overlap them
+            clone_sha, _ = await asyncio.gather(
+                asyncio.to_thread(clone_and_extract_files, request.url),
+                asyncio.to_thread(extract_issues, request.url, output_file=ISSUES_CSV, token=token),
+            )
 
-        # build groq index (chunked)
-        try:
-            build_groq_index()
-            print("✅ Groq chunked index built.")
-        except Exception as e_index:
-            print(f"⚠️ Warning: failed to build Groq index: {e_index}")
-
-        # NEW: Generate repository summary (robust handling)
-        print("📖 Generating repository summary...")
-        summary = ""
-        try:
-            # summarize_repository accepts a 'model' argument in your original implementation
-            summary = summarize_repository(model=request.model)
-            print("✅ Repository summary generated.")
-        except Exception as e_summary:
-            print(f"⚠️ Warning: failed to generate repository summary: {e_summary}")
-            summary = "Summary generation failed. Please check API keys and repo contents."
+            # summary only reads the CSVs, so generate it while the indexes build
+            indexes_built, summary = await asyncio.gather(
+                asyncio.to_thread(build_indexes_safe),
+                asyncio.to_thread(generate_summary_safe, request.model,
+                                  f"{request.url}@{clone_sha}" if clone_sha else None),
+            )
+
+            # stored under the cloned commit, so a push between ls-remote and clone can't
+            # file one commit's indexes under another's SHA
+            if sha and clone_sha and clone_sha != sha:
+                print(f"⚠️ Remote HEAD moved to {clone_sha[:12]} during processing; caching under the cloned commit")
+            if indexes_built and clone_sha:
+                try:
+                    await asyncio.to_thread(
+                        store_artifacts, repo_cache_dir(request.url, clone_sha), CACHED_ARTIFACTS, CACHE_MANIFEST
+                    )
+                except Exception as e_cache:
+                    print(f"⚠️ Warning: failed to cache repo artifacts: {e_cache}")
 
         print("✅ Processing complete.")
         if not os.path.exists(ISSUES_CSV):
@@ -230,10 +337,8 @@ async def process_repo(request: RepoRequest):
         df_issues['id'] = df_issues['number']
 
         issues_df_subset = df_issues[['id', 'title', 'body']].copy()
-        for col in ['id', 'title', 'body']:
-            issues_df_subset[col] = issues_df_subset[col].apply(
-                lambda v: "" if v is None else (str(v) if not isinstance(v, (str, int, bool, list, dict)) else v)
-            )
+        issues_df_subset['id'] = pd.to_numeric(issues_df_subset['id'], errors='coerce').fillna(0).astype(int)
+        issues_df_subset[['title', 'body']] = issues_df_subset[['title', 'body']].astype(str)
 
         issues_list = issues_df_subset.to_dict(orient="records")
         safe_payload = jsonable_encoder({
@@ -248,88 +353,131 @@ async def process_repo(request: RepoRequest):
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"An error occurred: {str(e)}")
 
 
-# API: ask-ai (handles Gemini and Groq)
-@app.post("/ask-ai")
-async def ask_ai(request: AiRequest):
-    print(f"🤖 Chat request (model: {request.model}) for issue {request.issue_id}")
+# Chat session helpers shared by /ask-ai and /ask-ai/stream
+def get_chat_session(request: AiRequest):
+    session_key = f"{request.issue_id}_{request.model}"
 
-    if request.model not in ["gemini", "groq"]:
-        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Model must be 'gemini' or 'groq'")
+    # Create new chat session if missing
+    if session_key not in chat_sessions:
+        print(f"Creating new chat session for issue {request.issue_id} ({request.model})...")
+
+        issue = load_issue_by_id(ISSUES_CSV, request.issue_id)
+        if issue is None:
+            raise HTTPException(status_code=404, detail="Selected issue not found.")
+
+        print("Retrieving relevant files...")
 
+        if request.model == "gemini":
+            repo_context = retrieve_gemini_files(issue.get("body", ""))
+            system_prompt = create_gemini_prompt(issue, repo_context)
+            # start Gemini chat with system prompt in history
+            chat = gemini_model.start_chat(
+                history=[{"role": "user", "parts": system_prompt}]
+            )
+            chat_sessions[session_key] = chat
+        else:
+            # groq: chunked retrieval + token-aware prompt
+            repo_context = retrieve_groq_files(issue.get("body", ""))
+            prompt, token_count = create_groq_prompt(issue, repo_context)
+
+            # token limiter check (guard TPM)
+            if not token_limiter.allow(token_count):
+                raise HTTPException(status_code=429, detail="Token-per-minute quota exceeded. Try again later.")
+
+            # store session with system prompt and token_count
+            chat = {
+                "messages": [{"role": "system", "content": prompt}],
+                "model": GROQ_MODEL_NAME,
+                "initial_prompt_tokens": token_count
+            }
+            chat_sessions[session_key] = chat
+
+    return chat_sessions[session_key]
+
+
+# lock serializing Gemini sends (and stream settling) on one chat session
+def get_session_lock(request: AiRequest) -> asyncio.Lock:
+    return chat_locks.setdefault(f"{request.issue_id}_{request.model}", asyncio.Lock())
+
+
+def settle_chat_stream(request: AiRequest, response):
+    """Finishes an interrupted Gemini stream so its ChatSession can send again, else drops the session."""
     try:
-        session_key = f"{request.issue_id}_{request.model}"
+        response.resolve()
+    except Exception as e:
+        print(f"⚠️ Dropping chat session for issue {request.issue_id} after a broken stream: {e}")
+        chat_sessions.pop(f"{request.issue_id}_{request.model}", None)
 
-        # Create new chat session if missing
-        if session_key not in chat_sessions:
-            print(f"Creating new chat session for issue {request.issue_id} ({request.model})...")
 
-            issue = load_issue_by_id(ISSUES_CSV, request.issue_id)
-            if issue is None:
-                raise HTTPException(status_code=404, detail="Selected issue not found.")
+def add_groq_user_message(chat: dict, prompt: str) -> dict:
+    # Optional: charge tokens for the user's prompt as well (best-effort)
+    try:
+        # estimate token usage for this call: initial_prompt_tokens + user prompt tokens
+        initial_tokens = chat.get("initial_prompt_tokens", 0)
+        user_tokens = count_tokens_groq(prompt)
+        total_call_tokens = initial_tokens + user_tokens
+        if not token_limiter.allow(total_call_tokens):
+            raise HTTPException(status_code=429, detail="Token-per-minute quota exceeded for this request.")
 
-            print("Retrieving relevant files...")
+    except HTTPException:
+        raise
+    except Exception:
+        # if token estimation fails, proceed but log
+        print("⚠️ Token estimation for Groq call failed; proceeding without strict TPM check.")
+
+    # Groq: append user's message to messages (only once the quota check passed)
+    message = {"role": "user", "content": prompt}
+    chat["messages"].append(message)
+    return message
 
-            if request.model == "gemini":
-                repo_context = retrieve_gemini_files(issue.get("body", ""))
-                system_prompt = create_gemini_prompt(issue, repo_context)
-                # start Gemini chat with system prompt in history
-                chat = genai.GenerativeModel(GEMINI_MODEL_NAME).start_chat(
-                    history=[{"role": "user", "parts": system_prompt}]
-                )
-                chat_sessions[session_key] = chat
-            else:
-                # groq: chunked retrieval + token-aware prompt
-                repo_context = retrieve_groq_files(issue.get("body", ""))
-                prompt, token_count = create_groq_prompt(issue, repo_context)
 
-                # token limiter check (guard TPM)
-                if not token_limiter.allow(token_count):
-                    raise HTTPException(status_code=429, detail="Token-per-minute quota exceeded. Try again later.")
+def drop_groq_user_message(chat: dict, message: dict):
+    # Unanswered turn (failed call / broken stream): remove it so the next request
+    # doesn't send two user turns in a row or pay for a prompt that got no reply
+    for i in range(len(chat["messages"]) - 1, -1, -1):
+        if chat["messages"][i] is message:
+            del chat["messages"][i]
+            break
 
-                # store session with system prompt and token_count
-                chat = {
-                    "messages": [{"role": "system", "content": prompt}],
-                    "model": GROQ_MODEL_NAME,
-                    "initial_prompt_tokens": token_count
-                }
-                chat_sessions[session_key] = chat
 
-        chat = chat_sessions[session_key]
+def validate_model(model: str):
+    if model not in ["gemini", "groq"]:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Model must be 'gemini' or 'groq'")
+
+
+# API: ask-ai (handles Gemini and Groq)
+@app.post("/ask-ai")
+async def ask_ai(request: AiRequest):
+    print(f"🤖 Chat request (model: {request.model}) for issue {request.issue_id}")
+
+    validate_model(request.model)
+
+    try:
+        # retrieval (encode + FAISS) and LLM calls block -> run them in the threadpool
+        chat = await asyncio.to_thread(get_chat_session, request)
 
         print(f"Sending prompt to {request.model}...")
 
         if request.model == "gemini":
-            # Gemini: append user's prompt via SDK
-            response = chat.send_message(request.prompt)
+            # Gemini: append user's prompt via SDK (one send per ChatSession at a time;
+            # to_thread would otherwise let two requests reach it concurrently)
+            async with get_session_lock(request):
+                response = await asyncio.to_thread(chat.send_message, request.prompt)
             response_text = response.text
         else:
-            # Groq: append user's message to messages
-            chat["messages"].append({"role": "user", "content": request.prompt})
-
-            # Optional: charge tokens for the user's prompt as well (best-effort)
-            try:
-                # estimate token usage for this call: initial_prompt_tokens + user prompt tokens
-                initial_tokens = chat.get("initial_prompt_tokens", 0)
-                user_tokens = count_tokens_groq(request.prompt)
-                total_call_tokens = initial_tokens + user_tokens
-                if not token_limiter.allow(total_call_tokens):
-                    raise HTTPException(status_code=429, detail="Token-per-minute quota exceeded for this request.")
-
-            except HTTPException:
-                raise
-            except Exception:
-                # if token estimation fails, proceed but log
-                print("⚠️ Token estimation for Groq call failed; proceeding without strict TPM check.")
+            user_message = add_groq_user_message(chat, request.prompt)
 
             try:
                 # Use the method you had previously; many groq SDKs expose chat.completions.create
-                response = groq_client.chat.completions.create(
+                response = await asyncio.to_thread(
+                    groq_client.chat.completions.create,
                     model=chat["model"],
                     messages=chat["messages"],
                     temperature=0.7,
                 )
             except Exception as e:
                 print("❌ Error calling Groq client:", e)
+                drop_groq_user_message(chat, user_message)
                 raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
                                     detail=f"Groq client error: {e}")
 
@@ -356,6 +504,85 @@ async def ask_ai(request: AiRequest):
                             detail=f"An error occurred with the AI model: {str(e)}")
 
 
+# SSE frame helper
+def sse_event(payload: dict) -> str:
+    return f"data: {json.dumps(payload)}\n\n"
+
+
+# API: ask-ai/stream (same as /ask-ai, but tokens are streamed as SSE frames)
+@app.post("/ask-ai/stream")
+async def ask_ai_stream(request: AiRequest):
+    print(f"🤖 Streaming chat request (model: {request.model}) for issue {request.issue_id}")
+
+    validate_model(request.model)
+
+    # session setup errors (404 / 429) are raised before the stream starts
+    user_message = None  # Groq turn added for this request, removed again if never answered
+    try:
+        chat = await asyncio.to_thread(get_chat_session, request)
+        if request.model == "groq":
+            user_message = add_groq_user_message(chat, request.prompt)
+    except HTTPException:
+        raise
+    except Exception as e:
+        print(f"❌ Error during AI chat: {e}")
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                            detail=f"An error occurred with the AI model: {str(e)}")
+
+    loop = asyncio.get_running_loop()
+    session_lock = get_session_lock(request)
+
+    # sync generator -> Starlette iterates it in a threadpool, so the event loop isn't blocked
+    def event_stream():
+        parts = []
+        response = None  # Gemini streamed response, settled in finally if left unfinished
+        completed = False
+        locked = False
+        try:
+            print(f"Streaming prompt to {request.model}...")
+            if request.model == "gemini":
+                # held until the reply is fully read or settled, so no other send overlaps it
+                asyncio.run_coroutine_threadsafe(session_lock.acquire(), loop).result()
+                locked = True
+                response = chat.send_message(request.prompt, stream=True)
+                for chunk in response:
+                    if chunk.parts:  # the closing chunk may carry only the finish reason
+                        parts.append(chunk.text)
+                        yield sse_event({"delta": chunk.text})
+            else:
+                stream = groq_client.chat.completions.create(
+                    model=chat["model"],
+                    messages=chat["messages"],
+                    temperature=0.7,
+                    stream=True,
+                )
+                for chunk in stream:
+                    delta = chunk.choices[0].delta.content if chunk.choices else None
+                    if delta:
+                        parts.append(delta)
+                        yield sse_event({"delta": delta})
+
+                # append assistant reply to history
+                chat["messages"].append({"role": "assistant", "content": "".join(parts)})
+            completed = True
+
+            print(f"✅ Streamed response from {request.model}")
+            yield sse_event({"done": True})
+        except Exception as e:
+            print(f"❌ Error during AI chat stream: {e}")
+            yield sse_event({"error": f"An error occurred with the AI model: {str(e)}"})
+        finally:
+            # Runs on errors and on client disconnect (generator closed mid-stream)
+            if response is not None and not completed:
+                settle_chat_stream(request, response)
+            if locked:
+                loop.call_soon_threadsafe(session_lock.release)
+            if user_message is not None and not completed:
+                drop_groq_user_message(chat, user_message)
+
+    return StreamingResponse(event_stream(), media_type="text/event-stream")
+
+
 # API: available models
 @app.get("/models")
 async def get_models():
@@ -372,6 +599,7 @@ async def get_models():
 async def cleanup():
     cleanup_temp_data()
     chat_sessions.clear()
+    chat_locks.clear()
     return {"message": "Cleanup complete"}
 
 
@@ -0,0 +1,45 @@
+import dbm
+import hashlib
+import os
+import numpy as np
+
+# CONFIGURATION
+EMBED_CACHE_PATH = r"embeddings/embed_cache.db"
+
+
+def _cache_key(model_name: str, text: str) -> str:
+    return hashlib.sha256(f"{model_name}\0{text}".encode("utf-8")).hexdigest()
+
+
+# ENCODE WITH ON-DISK CACHE
+def encode_with_cache(model, texts: list, model_name: str, **encode_kwargs) -> np.ndarray:
+    """Encodes texts, reusing embeddings already stored on disk for identical content.
+
+    Only cache misses go through the encoder; results are returned in the
+    original order as a float32 matrix.
+    """
+    os.makedirs(os.path.dirname(EMBED_CACHE_PATH) or ".", exist_ok=True)
+
+    # normalized and raw vectors for the same text must not share a cache entry
+    namespace = f"{model_name}:normalized" if encode_kwargs.get("normalize_embeddings") else model_name
+    keys = [_cache_key(namespace, text) for text in texts]
+    vectors = [None] * len(texts)
+
+    with dbm.open(EMBED_CACHE_PATH, "c") as db:
+        misses = []
+        for i, key in enumerate(keys):
+            raw = db.get(key)
+            if raw is None:
+                misses.append(i)
+            else:
+                vectors[i] = np.frombuffer(raw, dtype="float32")
+
+        print(f"♻️ Embedding cache: {len(texts) - len(misses)} hits, {len(misses)} to encode")
+
+        if misses:
+            embeddings = model.encode([texts[i] for i in misses], convert_to_numpy=True, **encode_kwargs)
+            for i, vec in zip(misses, embeddings.astype("float32")):
+                db[keys[i]] = vec.tobytes()
+                vectors[i] = vec
+
+    return np.vstack(vectors)
@@ -1,28 +1,43 @@
 # groq_utils.py
+import hashlib
 import os
-import pickle
+import threading
 import time
 from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 from typing import Tuple
 
 import numpy as np
 import pandas as pd
+import pyarrow.parquet as pq
 import tiktoken
+from cachetools import LRUCache
+import torch
 from dotenv import load_dotenv
 from groq import Groq
 from sentence_transformers import SentenceTransformer
 import faiss
 
+from models.embed_cache import encode_with_cache
+from models.search_batcher import SearchBatcher
+
 # CONFIGURATION
 MODEL_NAME = "openai/gpt-oss-120b"
 FILES_CSV = r"data/repo_files_data.csv"
 ISSUES_CSV = r"data/repo_issues.csv"
 CUSTOM_MODEL_PATH = r"sentence-transformers/all-MiniLM-L6-v2"
-INDEX_PATH = r"embeddings/repo_index.pkl"
+INDEX_PATH = r"embeddings/repo.faiss"
+CHUNKS_PATH = r"embeddings/repo_chunks.parquet"
+CHUNK_COLUMNS = ["file_name", "file_path", "file_extension", "chunk_id", "chunk_text"]
 
 CHUNK_MAX_TOKENS = 400
 CHUNK_OVERLAP_TOKENS = 40
-EMBED_BATCH_SIZE = 64
+CHUNK_CHARS_PER_TOKEN = 6  # generous chars/token bound for the retrieval-time safety cap
+EMBED_BATCH_SIZE = 128
+# Recorded in the /process-repo artifact cache manifest; keep in sync with build_vector_index
+INDEX_PARAMS = {"type": "IndexScalarQuantizer", "quantizer": "QT_8bit", "metric": "inner_product"}
+PARALLEL_CHUNK_MIN_FILES = 200  # below this, handing rows to worker threads costs more than it saves
 
 TOP_K = 5
 
@@ -36,6 +51,7 @@ TPM_WINDOW_SECONDS = 60
 
 
 # TOKENIZER HELPERS
+@lru_cache(maxsize=4)
 def _get_tokenizer(enc_name: str = TOKEN_ENCODING):
     return tiktoken.get_encoding(enc_name)
 
@@ -45,6 +61,45 @@ def count_tokens(text: str, enc_name: str = TOKEN_ENCODING) -> int:
     return len(enc.encode(text))
 
 
+# EMBEDDING MODEL & INDEX CACHE
+_EMBED_MODEL = None
+_INDEX_CACHE = {"mtime": None, "index": None, "chunks": None}
+# final repo_context per (index version, top_k, query); locked since retrieval runs in worker threads
+_CONTEXT_CACHE = LRUCache(maxsize=256)
+_CONTEXT_CACHE_LOCK = threading.Lock()
+# concurrent requests' FAISS searches are coalesced into one batched index.search
+_SEARCH_BATCHER = SearchBatcher()
+
+
+def _get_embed_model() -> SentenceTransformer:
+    global _EMBED_MODEL
+    if _EMBED_MODEL is None:
+        _EMBED_MODEL = SentenceTransformer(CUSTOM_MODEL_PATH)
+    return _EMBED_MODEL
+
+
+def _load_index():
+    mtime = (os.stat(INDEX_PATH).st_mtime_ns, os.stat(CHUNKS_PATH).st_mtime_ns)
+    if _INDEX_CACHE["mtime"] != mtime:
+        # MMAP_IFC maps the flat SQ codes (IO_FLAG_MMAP only applies to IVF inverted lists)
+        index = faiss.read_index(INDEX_PATH, faiss.IO_FLAG_MMAP_IFC | faiss.IO_FLAG_READ_ONLY)
+        # kept as an Arrow table: only the top-k rows are turned into Python objects per query
+        chunks = pq.read_table(CHUNKS_PATH, columns=CHUNK_COLUMNS, memory_map=True)
+        _INDEX_CACHE.update(mtime=mtime, index=index, chunks=chunks)
+    return _INDEX_CACHE["index"], _INDEX_CACHE["chunks"]
+
+
+def release_index():
+    """Drops the loaded index and chunk table, unmapping their files so they can be replaced or deleted."""
+    _INDEX_CACHE.update(mtime=None, index=None, chunks=None)
+
+
+@lru_cache(maxsize=1024)
+def _embed_query(text: str) -> bytes:
+    # bytes keep the cached entries hashable and compact
+    return _get_embed_model().encode([text], convert_to_numpy=True).astype("float32").tobytes()
+
+
 # ENV / GROQ CLIENT
 def load_env_and_configure() -> Groq:
     load_dotenv()
@@ -56,6 +111,17 @@ def load_env_and_configure() -> Groq:
     return client
 
 
+_GROQ_CLIENT = None
+
+
+def get_groq_client() -> Groq:
+    # one client per process so its connection pool (and TLS sessions) are reused
+    global _GROQ_CLIENT
+    if _GROQ_CLIENT is None:
+        _GROQ_CLIENT = load_env_and_configure()
+    return _GROQ_CLIENT
+
+
 # TOKEN RATE LIMITER
 class TokenRateLimiter:
     def __init__(self, token_limit=TPM_LIMIT, window_seconds=TPM_WINDOW_SECONDS):
@@ -85,13 +151,16 @@ def chunk_text_by_tokens(text: str, max_tokens: int = CHUNK_MAX_TOKENS, overlap:
         return []
 
     step = max_tokens - overlap if (max_tokens - overlap) > 0 else max_tokens
-    chunks = []
-    start = 0
-    while start < len(token_ids):
-        chunk_ids = token_ids[start:start + max_tokens]
-        chunks.append(enc.decode(chunk_ids))
-        start += step
-    return chunks
+    return [enc.decode(token_ids[start:start + max_tokens]) for start in range(0, len(token_ids), step)]
+
+
+def _chunk_one(args) -> list:
+    file_name, file_path, file_ext, content, max_tokens = args
+    if not content.strip():
+        return [(file_name, file_path, file_ext, 0, "")]
+
+    chunks = chunk_text_by_tokens(content, max_tokens=max_tokens, overlap=CHUNK_OVERLAP_TOKENS)
+    return [(file_name, file_path, file_ext, cid, ctext) for cid, ctext in enumerate(chunks)]
 
 
 # BUILD VECTOR INDEX (CHUNKED)
@@ -105,73 +174,83 @@ def build_vector_index(chunk_max_tokens: int = CHUNK_MAX_TOKENS):
     if df.empty:
         raise ValueError("repo_files_data.csv is empty.")
 
+    meta_cols = ["file_name", "file_path", "file_extension", "file_content"]
+    for col in meta_cols:
+        if col not in df.columns:
+            df[col] = ""
+    df = df.fillna({col: "" for col in meta_cols})
+
+    # plain column iteration avoids iterrows' per-row Series boxing
+    file_rows = [
+        (file_name, file_path, file_ext, content, chunk_max_tokens)
+        for file_name, file_path, file_ext, content in zip(
+            df["file_name"], df["file_path"], df["file_extension"], df["file_content"].astype(str)
+        )
+    ]
+
     records = []
 
-    for _, row in df.iterrows():
-        file_name = row.get("file_name", "")
-        file_path = row.get("file_path", "")
-        file_ext = row.get("file_extension", "")
-        content = str(row.get("file_content", "") or "")
-
-        if not content.strip():
-            records.append({
-                "file_name": file_name,
-                "file_path": file_path,
-                "file_extension": file_ext,
-                "chunk_id": 0,
-                "chunk_text": ""
-            })
-            continue
-
-        chunks = chunk_text_by_tokens(content, max_tokens=chunk_max_tokens, overlap=CHUNK_OVERLAP_TOKENS)
-
-        for cid, ctext in enumerate(chunks):
-            records.append({
-                "file_name": file_name,
-                "file_path": file_path,
-                "file_extension": file_ext,
-                "chunk_id": cid,
-                "chunk_text": ctext
-            })
-
-    chunks_df = pd.DataFrame(records)
+    # tiktoken releases the GIL while encoding/decoding, so threads shard large repos
+    # without forking this (multi-threaded, torch-loaded) process or re-importing it in spawned workers
+    if len(file_rows) >= PARALLEL_CHUNK_MIN_FILES and (os.cpu_count() or 1) > 1:
+        with ThreadPoolExecutor(max_workers=os.cpu_count()) as ex:
+            for recs in ex.map(_chunk_one, file_rows):
+                records.extend(recs)
+    else:
+        for row in file_rows:
+            records.extend(_chunk_one(row))
+
+    chunks_df = pd.DataFrame.from_records(
+        records, columns=["file_name", "file_path", "file_extension", "chunk_id", "chunk_text"]
+    )
     if chunks_df.empty:
         raise ValueError("No chunks created.")
 
     print(f"📦 Total chunks: {len(chunks_df)} — embedding...")
 
-    embed_model = SentenceTransformer(CUSTOM_MODEL_PATH)
+    embed_model = _get_embed_model()
     texts = chunks_df["chunk_text"].tolist()
 
-    all_embeddings = []
-    for i in range(0, len(texts), EMBED_BATCH_SIZE):
-        batch = texts[i:i + EMBED_BATCH_SIZE]
-        emb = embed_model.encode(batch, convert_to_numpy=True)
-        all_embeddings.append(emb.astype("float32"))
-
-    embeddings = np.vstack(all_embeddings)
+    # cached chunks skip the encoder; only new/changed text is embedded.
+    # SentenceTransformer batches internally, and fp16 autocast on GPU
+    # halves memory traffic through the transformer forward pass.
+    with torch.autocast("cuda", dtype=torch.float16, enabled=embed_model.device.type == "cuda"):
+        embeddings = encode_with_cache(
+            embed_model,
+            texts,
+            CUSTOM_MODEL_PATH,
+            batch_size=EMBED_BATCH_SIZE,
+            show_progress_bar=True,
+            normalize_embeddings=True,
+        )
 
-    faiss.normalize_L2(embeddings)
-    index = faiss.IndexFlatIP(embeddings.shape[1])
+    # int8 scalar quantization: 4x smaller index, less memory traffic per search
+    index = faiss.IndexScalarQuantizer(embeddings.shape[1], faiss.ScalarQuantizer.QT_8bit,
+                                       faiss.METRIC_INNER_PRODUCT)
+    index.train(embeddings)
     index.add(embeddings)
 
     os.makedirs(os.path.dirname(INDEX_PATH) or ".", exist_ok=True)
-    with open(INDEX_PATH, "wb") as f:
-        pickle.dump((index, chunks_df), f)
+    # Write beside and swap in: truncating in place would corrupt the memory-mapped
+    # index/table still held by _load_index (and Windows refuses to replace a mapped file)
+    release_index()
+    chunks_df.to_parquet(CHUNKS_PATH + ".tmp", index=False, compression="zstd")
+    faiss.write_index(index, INDEX_PATH + ".tmp")
+    os.replace(CHUNKS_PATH + ".tmp", CHUNKS_PATH)
+    os.replace(INDEX_PATH + ".tmp", INDEX_PATH)
 
-    print(f"✅ Saved FAISS index to {INDEX_PATH}")
+    print(f"✅ Saved FAISS index to {INDEX_PATH} (chunks: {CHUNKS_PATH})")
 
 
 # RETRIEVAL (TOP-K CHUNKS)
 def retrieve_relevant_files(query: str, top_k: int = TOP_K) -> str:
     """
     Defensive retrieval of top-k chunks for a query.
-    - Rebuilds index if index file missing or corrupt.
-    - Ensures necessary columns exist with safe defaults.
+    - Rebuilds index if index/chunk files are missing, corrupt or lack columns.
     - Never raises KeyError for missing metadata like 'chunk_id'.
     """
     # Ensure index exists; attempt to build if missing
-    if not os.path.exists(INDEX_PATH):
+    if not (os.path.exists(INDEX_PATH) and os.path.exists(CHUNKS_PATH)):
         print("⚠️ Index file not found; building index now...")
         try:
             build_vector_index()
@@ -179,43 +258,35 @@ def retrieve_relevant_files(query: str, top_k: int = TOP_K) -> str:
             print("❌ Failed to build index:", e)
             return ""
 
-    # Load the index and chunks_df safely
+    # Load the index and chunk table safely
     try:
-        with open(INDEX_PATH, "rb") as f:
-            index, chunks_df = pickle.load(f)
+        index, chunks = _load_index()
     except Exception as e:
-        print("❌ Failed to load index pickle:", e)
+        print("❌ Failed to load index:", e)
         # try a rebuild once
         try:
             build_vector_index()
-            with open(INDEX_PATH, "rb") as f:
-                index, chunks_df = pickle.load(f)
+            index, chunks = _load_index()
         except Exception as e2:
             print("❌ Rebuild failed:", e2)
             return ""
 
-    # Validate chunks_df
-    if not isinstance(chunks_df, pd.DataFrame) or chunks_df.empty:
-        print("⚠️ Chunks DataFrame is empty or invalid — no repository context available.")
-        return ""
+    # Index file mtime doubles as the index version -> rebuilt/restored indexes miss the cache
+    cache_key = (_INDEX_CACHE["mtime"], top_k, hashlib.sha1(query.encode("utf-8")).digest())
+    with _CONTEXT_CACHE_LOCK:
+        cached = _CONTEXT_CACHE.get(cache_key)
+    if cached is not None:
+        return cached
 
-    # Ensure expected columns exist; add safe defaults if missing
-    required_cols = {
-        "file_name": "",
-        "file_path": "",
-        "file_extension": "",
-        "chunk_id": 0,
-        "chunk_text": ""
-    }
-    for col, default in required_cols.items():
-        if col not in chunks_df.columns:
-            print(f"⚠️ chunks_df missing column '{col}' — adding default values.")
-            chunks_df[col] = default
+    # Validate chunk table (columns are guaranteed by read_table(columns=CHUNK_COLUMNS))
+    if chunks.num_rows == 0:
+        print("⚠️ Chunk table is empty — no repository context available.")
+        return ""
 
     # Prepare embedding for query
     try:
-        embed_model = SentenceTransformer(CUSTOM_MODEL_PATH)
-        query_emb = embed_model.encode([query], convert_to_numpy=True).astype("float32")
+        # copy: frombuffer is read-only and normalize_L2 works in place
+        query_emb = np.frombuffer(_embed_query(query), dtype="float32").reshape(1, -1).copy()
     except Exception as e:
         print("❌ Failed to embed query:", e)
         return ""
@@ -231,37 +302,29 @@ def retrieve_relevant_files(query: str, top_k: int = TOP_K) -> str:
         k = min(top_k, int(index.ntotal))
         if k <= 0:
             return ""
-        D, I = index.search(query_emb, k)
+        D, I = _SEARCH_BATCHER.search(index, query_emb, k)
         indices = [int(i) for i in I[0] if i != -1]
     except Exception as e:
         print("❌ FAISS search failed:", e)
         return ""
 
     # Validate indices
-    indices = [i for i in indices if 0 <= i < len(chunks_df)]
+    indices = [i for i in indices if 0 <= i < chunks.num_rows]
     if not indices:
         print("⚠️ FAISS returned no valid chunk indices.")
         return ""
 
     # Build repo_context safely
-    enc = _get_tokenizer()
     parts = []
-    for idx in indices:
-        rec = chunks_df.iloc[idx].to_dict()
+    for rec in chunks.take(indices).to_pylist():
         fname = rec.get("file_name") or ""
         fpath = rec.get("file_path") or ""
         fext = rec.get("file_extension") or ""
         chunk_id = rec.get("chunk_id") if rec.get("chunk_id") is not None else 0
         chunk_text = str(rec.get("chunk_text") or "")
 
-        # Safety: trim long chunk_text by tokens
-        try:
-            token_ids = enc.encode(chunk_text)
-            if len(token_ids) > CHUNK_MAX_TOKENS:
-                chunk_text = enc.decode(token_ids[:CHUNK_MAX_TOKENS])
-        except Exception:
-            # fallback: character truncate
-            chunk_text = chunk_text[:2000]
+        # chunks are built with <= CHUNK_MAX_TOKENS tokens already; cheap char cap as a safety net
+        chunk_text = chunk_text[:CHUNK_MAX_TOKENS * CHUNK_CHARS_PER_TOKEN]
 
         snippet = (
             f"\n\n### File: {fname} ({fpath}) [chunk {chunk_id}]\n"
@@ -269,17 +332,37 @@ def retrieve_relevant_files(query: str, top_k: int = TOP_K) -> str:
         )
         parts.append(snippet)
 
-    return "".join(parts)
+    repo_context = "".join(parts)
+    with _CONTEXT_CACHE_LOCK:
+        _CONTEXT_CACHE[cache_key] = repo_context
+    return repo_context
 
 
 # PROMPT CREATION
+PROMPT_FOOTER = (
+    "\n\nYour task:\n"
+    "- Analyze the files and issue.\n"
+    "- Suggest exact code fixes.\n"
+    "- Provide reasoning.\n"
+    "- Keep formatting clean.\n"
+    "- Dont generate Tables"
+)
+
+
+@lru_cache(maxsize=1)
+def _footer_tokens() -> int:
+    # footer is constant, so its token count only needs computing once
+    return count_tokens(PROMPT_FOOTER)
+
+
 def create_prompt(issue: dict, repo_context: str) -> Tuple[str, int]:
     issue_title = issue.get("title", "Untitled Issue")
     issue_body = str(issue.get("body", ""))
 
-    if count_tokens(issue_body) > 800:
-        enc = _get_tokenizer()
-        issue_body = enc.decode(enc.encode(issue_body)[:800])
+    enc = _get_tokenizer()
+    body_ids = enc.encode(issue_body)
+    if len(body_ids) > 800:
+        issue_body = enc.decode(body_ids[:800])
 
     header = (
         "You are Desolve AI — an expert AI developer assistant.\n\n"
@@ -287,17 +370,9 @@ def create_prompt(issue: dict, repo_context: str) -> Tuple[str, int]:
         "Relevant repository chunks:\n"
     )
 
-    footer = (
-        "\n\nYour task:\n"
-        "- Analyze the files and issue.\n"
-        "- Suggest exact code fixes.\n"
-        "- Provide reasoning.\n"
-        "- Keep formatting clean.\n"
-        "- Dont generate Tables"
-    )
+    footer = PROMPT_FOOTER
 
-    enc = _get_tokenizer()
-    allowed_ctx = max(0, MAX_INPUT_TOKENS - RESERVED_TOKENS - count_tokens(header) - count_tokens(footer))
+    allowed_ctx = max(0, MAX_INPUT_TOKENS - RESERVED_TOKENS - count_tokens(header) - _footer_tokens())
 
     ctx_ids = enc.encode(repo_context)
     if len(ctx_ids) > allowed_ctx:
@@ -329,7 +404,7 @@ def ask_issue_with_groq(issue_row_index: int = 0):
     if not limiter.allow(token_count):
         raise RuntimeError("TPM limit exceeded — slow down.")
 
-    client = load_env_and_configure()
+    client = get_groq_client()
 
     try:
         response = client.chat.create(
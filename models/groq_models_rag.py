@@ -1,20 +1,72 @@
+import hashlib
 import os
-import pickle
+import threading
+from functools import lru_cache
+import numpy as np
 import pandas as pd
+from cachetools import LRUCache
 from dotenv import load_dotenv
 from groq import Groq
 from sentence_transformers import SentenceTransformer
 import faiss
 
+from models.embed_cache import encode_with_cache
+from models.search_batcher import SearchBatcher
+
 # CONFIGURATION
 MODEL_NAME = "openai/gpt-oss-120b"
 FILES_CSV = r"data/repo_files_data.csv"
 ISSUES_CSV = r"data/repo_issues.csv"
 CUSTOM_MODEL_PATH = r"sentence-transformers/all-MiniLM-L6-v2"
-INDEX_PATH = r"embeddings/repo_index.pkl"
+INDEX_PATH = r"embeddings/repo_files.faiss"  # native FAISS format; SQ codes memory-mapped on load
+META_PATH = r"embeddings/repo_files.parquet"  # per-file metadata, row i <-> vector i
+META_COLUMNS = ["preformatted"]  # Prompt-ready "### File: ..." block per file
+SNIPPET_CHARS = 2500  # Characters of each file passed to the prompt
+HNSW_M = 32  # Graph neighbours per node in the HNSW index
+HNSW_EF_CONSTRUCTION = 80
 
 TOP_K = 5  # Number of most relevant files to retrieve per issue
 
+# EMBEDDING MODEL & INDEX CACHE
+_EMBED_MODEL = None
+_INDEX_CACHE = {"mtime": None, "index": None, "df": None}
+# Final repo_context per (index version, top_k, query); guarded since retrieval runs in worker threads
+_CONTEXT_CACHE = LRUCache(maxsize=256)
+_CONTEXT_CACHE_LOCK = threading.Lock()
+# Concurrent requests' FAISS searches are coalesced into one batched index.search
+_SEARCH_BATCHER = SearchBatcher()
+
+
+def _get_embed_model():
+    """Loads the SentenceTransformer once and reuses it across calls."""
+    global _EMBED_MODEL
+    if _EMBED_MODEL is None:
+        _EMBED_MODEL = SentenceTransformer(CUSTOM_MODEL_PATH)
+    return _EMBED_MODEL
+
+
+def _load_index():
+    """Loads (index, df) from disk, reusing the cached copy until either file changes."""
+    mtime = (os.stat(INDEX_PATH).st_mtime_ns, os.stat(META_PATH).st_mtime_ns)
+    if _INDEX_CACHE["mtime"] != mtime:
+        # MMAP_IFC maps the flat SQ codes (IO_FLAG_MMAP only applies to IVF inverted lists)
+        index = faiss.read_index(INDEX_PATH, faiss.IO_FLAG_MMAP_IFC | faiss.IO_FLAG_READ_ONLY)
+        df = pd.read_parquet(META_PATH, columns=META_COLUMNS)
+        _INDEX_CACHE.update(mtime=mtime, index=index, df=df)
+    return _INDEX_CACHE["index"], _INDEX_CACHE["df"]
+
+
+def release_index():
+    """Drops the loaded index, unmapping its file so it can be replaced or deleted."""
+    _INDEX_CACHE.update(mtime=None, index=None, df=None)
+
+
+@lru_cache(maxsize=1024)
+def _embed_query(text: str) -> bytes:
+    """Embeds a query once; repeated queries are served from the cache."""
+    return _get_embed_model().encode([text], convert_to_numpy=True, normalize_embeddings=True).astype("float32").tobytes()
+
+
 # LOAD ENVIRONMENT VARIABLES
 def load_env_and_configure():
     """Loads .env file and configures the GROQ API key (Groq client)."""
@@ -25,6 +77,7 @@ def load_env_and_configure():
         print("❌ GROQ_API_KEY not found in .env file.")
         raise ValueError("GROQ_API_KEY not found in .env file.")
 
+    # The SDK's own pooled httpx client (keep-alive, limits, redirects); callers reuse this one client
     client = Groq(api_key=GROQ_API_KEY)
     print("✅ GROQ client configured.")
     return client
@@ -51,15 +104,33 @@ def build_vector_index():
 
     print(f"📄 Total files: {len(df)}")
 
-    model = SentenceTransformer(CUSTOM_MODEL_PATH)
+    model = _get_embed_model()
     file_texts = df["file_content"].fillna("").astype(str).tolist()
-    embeddings = model.encode(file_texts, convert_to_numpy=True, show_progress_bar=True)
-
-    index = faiss.IndexFlatL2(embeddings.shape[1])
-    index.add(embeddings.astype("float32"))
-
-    with open(INDEX_PATH, "wb") as f:
-        pickle.dump((index, df), f)
+    embeddings = encode_with_cache(model, file_texts, CUSTOM_MODEL_PATH,
+                                   show_progress_bar=True, normalize_embeddings=True)
+
+    # Unit vectors + inner product == cosine similarity; HNSW avoids a full scan per query
+    # and int8 scalar quantization stores each vector in a quarter of the bytes
+    index = faiss.IndexHNSWSQ(embeddings.shape[1], faiss.ScalarQuantizer.QT_8bit,
+                              HNSW_M, faiss.METRIC_INNER_PRODUCT)
+    index.hnsw.efConstruction = HNSW_EF_CONSTRUCTION
+    index.train(embeddings)
+    index.add(embeddings)
+
+    # Format each file's prompt block once here, so retrieval is just a lookup + join
+    meta = df.reindex(columns=["file_name", "file_path", "file_extension", "file_content"]).fillna("").astype(str)
+    df["preformatted"] = (
+        "\n\n### File: " + meta["file_name"] + " (" + meta["file_path"] + ")\n"
+        + "```" + meta["file_extension"] + "\n"
+        + meta["file_content"].str.slice(0, SNIPPET_CHARS) + "\n```\n"
+    )
+    # Write beside and swap in: truncating the file in place would corrupt an index
+    # still memory-mapped by _load_index (and Windows refuses to replace a mapped file)
+    release_index()
+    df[META_COLUMNS].to_parquet(META_PATH + ".tmp", index=False)
+    faiss.write_index(index, INDEX_PATH + ".tmp")
+    os.replace(META_PATH + ".tmp", META_PATH)
+    os.replace(INDEX_PATH + ".tmp", INDEX_PATH)
 
     print(f"✅ Vector index saved at: {INDEX_PATH}")
 
@@ -67,27 +138,28 @@ def build_vector_index():
 # LOAD INDEX & RETRIEVE RELEVANT FILES
 def retrieve_relevant_files(query: str, top_k: int = TOP_K):
     """Retrieves context from the vector index based on a query."""
-    if not os.path.exists(INDEX_PATH):
+    if not (os.path.exists(INDEX_PATH) and os.path.exists(META_PATH)):
         print("⚠️ Index not found. Building one now...")
         build_vector_index()
 
-    with open(INDEX_PATH, "rb") as f:
-        index, df = pickle.load(f)
+    index, df = _load_index()
+
+    # The index file stamps act as the index version, so rebuilt/restored indexes miss the cache
+    cache_key = (_INDEX_CACHE["mtime"], top_k, hashlib.sha1(query.encode("utf-8")).digest())
+    with _CONTEXT_CACHE_LOCK:
+        cached = _CONTEXT_CACHE.get(cache_key)
+    if cached is not None:
+        return cached
 
-    model = SentenceTransformer(CUSTOM_MODEL_PATH)
-    query_vec = model.encode([query], convert_to_numpy=True).astype("float32")
+    query_vec = np.frombuffer(_embed_query(query), dtype="float32").reshape(1, -1)
 
-    D, I = index.search(query_vec, top_k)
+    index.hnsw.efSearch = max(top_k * 4, 32)
+    D, I = _SEARCH_BATCHER.search(index, query_vec, top_k)
     indices = [i for i in I[0] if i != -1]
-    top_files = df.iloc[indices].to_dict(orient="records")
-
-    repo_context = ""
-    for file in top_files:
-        repo_context += (
-            f"\n\n### File: {file.get('file_name', '')} ({file.get('file_path', '')})\n"
-            f"```{file.get('file_extension', '')}\n"
-            f"{file.get('file_content', '')[:2500]}\n```\n"
-        )
+    repo_context = "".join(df["preformatted"].iloc[indices].tolist())
+
+    with _CONTEXT_CACHE_LOCK:
+        _CONTEXT_CACHE[cache_key] = repo_context
     return repo_context
 
 
@@ -0,0 +1,73 @@
+import queue
+import threading
+import time
+from concurrent.futures import Future
+import numpy as np
+
+# CONFIGURATION
+MAX_BATCH = 16  # Most queries answered by a single index.search call
+MAX_WAIT_SECONDS = 0.005  # How long the first query waits for others to join its batch
+
+
+class SearchBatcher:
+    """Coalesces concurrent FAISS searches into a single `index.search` call.
+
+    Retrieval runs in worker threads (one per in-flight request). Each caller
+    submits one query vector and blocks until a background thread has searched
+    the whole batch; searching Q stacked queries costs about the same as one.
+    """
+
+    def __init__(self, max_batch: int = MAX_BATCH, max_wait: float = MAX_WAIT_SECONDS):
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self._queue = queue.Queue()
+        self._worker = None
+        self._lock = threading.Lock()
+
+    def search(self, index, query_vec: np.ndarray, k: int):
+        """Same contract as `index.search(query_vec, k)` for a (1, d) query."""
+        self._ensure_worker()
+        future = Future()
+        self._queue.put((index, query_vec, k, future))
+        return future.result()
+
+    def _ensure_worker(self):
+        with self._lock:
+            if self._worker is None:
+                self._worker = threading.Thread(target=self._run, name="faiss-search-batcher", daemon=True)
+                self._worker.start()
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.max_wait
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+
+            # A rebuilt/reloaded index is a different object, so group by identity
+            groups = {}
+            for item in batch:
+                groups.setdefault(id(item[0]), []).append(item)
+            for items in groups.values():
+                self._search_group(items)
+
+    @staticmethod
+    def _search_group(items):
+        index = items[0][0]
+        k = max(item[2] for item in items)
+        try:
+            D, I = index.search(np.vstack([item[1] for item in items]), k)
+        except Exception as e:
+            for item in items:
+                item[3].set_exception(e)
+            return
+
+        # Top-k of the widest search is the caller's own top-k
+        for row, (_, _, item_k, future) in enumerate(items):
+            future.set_result((D[row:row + 1, :item_k], I[row:row + 1, :item_k]))
@@ -1,9 +1,52 @@
 import axios from "axios";
 
+const BASE_URL = "http://127.0.0.1:8000";
+
 const api = axios.create({
-  baseURL: "http://127.0.0.1:8000",
+  baseURL: BASE_URL,
 });
 
+// POST /ask-ai/stream and call onDelta for every SSE text frame.
+// Resolves with the full reply once the server sends {"done": true}.
+async function askAIStream(payload, onDelta) {
+  const res = await fetch(`${BASE_URL}/ask-ai/stream`, {
+    method: "POST",
+    headers: { "Content-Type": "application/json" },
+    body: JSON.stringify(payload),
+  });
+
+  if (!res.ok) {
+    const err = await res.json().catch(() => ({}));
+    throw new Error(err.detail || `Request failed (${res.status})`);
+  }
+
+  const reader = res.body.getReader();
+  const decoder = new TextDecoder();
+  let buffer = "";
+  let full = "";
+
+  while (true) {
+    const { value, done } = await reader.read();
+    if (done) break;
+    buffer += decoder.decode(value, { stream: true });
+
+    const frames = buffer.split("\n\n");
+    buffer = frames.pop();
+
+    for (const frame of frames) {
+      if (!frame.startsWith("data: ")) continue;
+      const event = JSON.parse(frame.slice(6));
+      if (event.error) throw new Error(event.error);
+      if (event.delta) {
+        full += event.delta;
+        onDelta(event.delta);
+      }
+    }
+  }
+
+  return full;
+}
+
 export const backend = {
   models: () => api.get("/models"),
 
@@ -11,6 +54,8 @@ export const backend = {
 
   askAI: (payload) => api.post("/ask-ai", payload),
 
+  askAIStream,
+
   cleanup: () => api.post("/cleanup"),
 };
 
@@ -24,17 +24,26 @@ export default function ChatUI() {
     setLoading(true);
 
     try {
-      const res = await backend.askAI({
+      let started = false;
+
+      await backend.askAIStream({
         issue_id: selectedIssue,
         prompt: userText,
         model: selectedModel
+      }, (delta) => {
+        // first token: swap the "Thinking..." bubble for the reply being streamed
+        if (!started) {
+          started = true;
+          setLoading(false);
+          setChatMessages(m => [...m, { role: "assistant", text: delta }]);
+          return;
+        }
+        setChatMessages(m => [
+          ...m.slice(0, -1),
+          { ...m[m.length - 1], text: m[m.length - 1].text + delta }
+        ]);
       });
 
-      setChatMessages(m => [
-        ...m,
-        { role: "assistant", text: res.data.response }
-      ]);
-
     } catch {
       setChatMessages(m => [...m, {
         role: "assistant",
@@ -0,0 +1,96 @@
+import json
+import os
+import shutil
+import git
+
+CACHE_DIR = r"cache"
+MANIFEST_NAME = "manifest.json"
+# Bump whenever the on-disk layout of a cached artifact changes (file format, columns...),
+# so entries written by an earlier build are rebuilt instead of restored
+ARTIFACT_FORMAT_VERSION = 2
+
+
+def get_remote_head_sha(repo_url):
+    """
+    Return the commit SHA of the remote HEAD without cloning, or None on failure.
+
+    Parameters:
+        repo_url (str): GitHub repository URL.
+    """
+    try:
+        output = git.cmd.Git().ls_remote(repo_url, "HEAD")
+    except Exception as e:
+        print(f"⚠️ Could not resolve remote HEAD for {repo_url}: {e}")
+        return None
+
+    return output.split()[0] if output else None
+
+
+def get_clone_head_sha(repo_path):
+    """
+    Return the commit SHA checked out in a local clone, or None on failure.
+
+    Parameters:
+        repo_path (str): Path of the cloned repository.
+    """
+    try:
+        return git.Repo(repo_path).head.commit.hexsha
+    except Exception as e:
+        print(f"⚠️ Could not read HEAD of {repo_path}: {e}")
+        return None
+
+
+def repo_cache_dir(repo_url, sha):
+    """Return the cache directory for a repository snapshot: cache/<repo>/<sha>."""
+    repo_name = repo_url.rstrip("/").split("/")[-1].replace(".git", "")
+    return os.path.join(CACHE_DIR, repo_name, sha)
+
+
+def restore_artifacts(cache_dir, artifact_paths, manifest):
+    """
+    Copy cached artifacts back to their working locations.
+
+    Parameters:
+        cache_dir (str): Directory returned by repo_cache_dir.
+        artifact_paths (list[str]): Working paths of the artifacts to restore.
+        manifest (dict): Settings the artifacts were built with (model, chunker...).
+
+    Returns:
+        bool: True if every artifact was restored, False on a cache miss.
+    """
+    manifest_path = os.path.join(cache_dir, MANIFEST_NAME)
+    if not os.path.exists(manifest_path):
+        return False
+
+    with open(manifest_path, "r", encoding="utf-8") as f:
+        if json.load(f) != manifest:
+            print("⚠️ Cached artifacts were built with different settings; ignoring cache.")
+            return False
+
+    cached = [os.path.join(cache_dir, os.path.basename(p)) for p in artifact_paths]
+    if not all(os.path.exists(p) for p in cached):
+        return False
+
+    for src, dest in zip(cached, artifact_paths):
+        os.makedirs(os.path.dirname(dest) or ".", exist_ok=True)
+        # Swap in a fresh file: a reader may still hold the previous one open. Callers
+        # release their memory-mapped indexes first, which Windows needs to replace them
+        shutil.copy2(src, dest + ".tmp")
+        os.replace(dest + ".tmp", dest)
+
+    print(f"♻️ Restored {len(cached)} cached artifacts from {cache_dir}")
+    return True
+
+
+def store_artifacts(cache_dir, artifact_paths, manifest):
+    """Copy freshly built artifacts into cache_dir, writing the manifest last."""
+    os.makedirs(cache_dir, exist_ok=True)
+
+    for src in artifact_paths:
+        shutil.copy2(src, os.path.join(cache_dir, os.path.basename(src)))
+
+    # Manifest marks the entry as complete, so a partial copy is never treated as a hit
+    with open(os.path.join(cache_dir, MANIFEST_NAME), "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+
+    print(f"✅ Cached {len(artifact_paths)} artifacts in {cache_dir}")
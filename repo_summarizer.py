@@ -1,20 +1,102 @@
+import asyncio
+import csv
+import json
 import os
-import pandas as pd
-from dotenv import load_dotenv
-import google.generativeai as genai
-from groq import Groq
+import pickle
+import re
+import sqlite3
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import closing
+from functools import lru_cache, partial
+from itertools import islice
+from typing import Final
+import numpy as np
+import tiktoken
+from tenacity import AsyncRetrying, stop_after_attempt, wait_exponential
 
 # CONFIGURATION
 FILES_CSV = r"data/repo_files_data.csv"
 ISSUES_CSV = r"data/repo_issues.csv"
+CSV_BLOCK_BYTES = 16 << 20  # Arrow parses the CSV in blocks of this size, bounding memory
+REPO_INFO_CACHE = r"data/.repo_info.pkl"
 SUMMARY_TARGET_LENGTH = 500  # words
+SUMMARY_CACHE_PATH = r"cache/summary_cache.sqlite"  # outside data/, which is wiped per repo
+SUMMARY_CACHE_THRESHOLD = 0.95  # cosine similarity above which a cached summary is reused
+SUMMARY_TIMEOUT_SECONDS = 30  # per attempt, per provider
+SUMMARY_ATTEMPTS = 3
+GEMINI_MODEL_NAME: Final = "gemini-2.5-flash-lite"
+GROQ_MODEL_NAME: Final = "openai/gpt-oss-120b"
+BATCH_MIN_REPOS = 9  # more than 8 contexts go through the Groq Batch API (cheaper, up to a 24h window)
+BATCH_POLL_SECONDS = 30
+CONTEXT_MAX_TOKENS = 800  # the instructions dominate quality; extra sample text only adds cost
+TOKEN_ENCODING = "cl100k_base"
+
+# Extension -> language, used to detect the programming languages of a repository
+LANG_MAP: Final[dict] = {
+    ".py": "Python",
+    ".js": "JavaScript",
+    ".ts": "TypeScript",
+    ".java": "Java",
+    ".cpp": "C++",
+    ".c": "C",
+    ".rb": "Ruby",
+    ".go": "Go",
+    ".rs": "Rust",
+    ".php": "PHP",
+    ".cs": "C#",
+    ".swift": "Swift",
+    ".kt": "Kotlin",
+}
+
+# Key files (README, setup, config, etc.) are matched by case-insensitive substring in the name
+KEY_KEYWORDS: Final = ("readme", "setup", "config", "main", "requirements", "dockerfile", "package.json")
+# One alternation scanned once per name; re.escape keeps "package.json"'s dot literal, and
+# matching ignores case inside the regex engine instead of allocating a lower-cased copy.
+# Arrow's regex kernel runs the alternation as one DFA pass over the name column, which is
+# several times faster than OR-ing per-keyword substring kernels or an any(k in name) loop
+KEY_FILE_RE: Final = re.compile("|".join(map(re.escape, KEY_KEYWORDS)), re.IGNORECASE)
+
+# Static instructions are sent as the system prompt so every request shares the same
+# prefix (provider-side prompt caching); only the analysis data varies per repository
+SUMMARY_INSTRUCTIONS = """Based on the following repository analysis, provide a comprehensive yet concise summary of approximately 500 words.
+Include:
+1. Project Overview - What is this project about?
+2. Technology Stack - What languages and frameworks are used?
+3. Structure - How is the codebase organized?
+4. Key Components - What are the main modules/files?
+5. Purpose & Functionality - What does this project do?
+6. Issues/Problems - What are users reporting/working on?
+
+Provide a well-structured, professional summary in exactly 500 words (±10 words)."""
+
+# User turn shared by both providers, so their requests differ only in the context itself
+_PROMPT_TEMPLATE = "Analysis Data:\n{context}"
+
+# Built once; every Groq request (live or batch) shares the same system message object
+_SYS_MSG = {
+    "role": "system",
+    "content": "You are an expert software engineer who provides clear, concise technical summaries.\n\n"
+               + SUMMARY_INSTRUCTIONS,
+}
+
+# Both SDKs' blocking calls run here rather than in the loop's default executor:
+# asyncio.run() joins that one on exit, which would make a lost race wait for the loser.
+# Sized for the largest live batch (every race running both providers), since the
+# per-attempt timeout also counts time spent queued for a worker
+_SUMMARY_EXECUTOR = ThreadPoolExecutor(max_workers=2 * (BATCH_MIN_REPOS - 1), thread_name_prefix="summary")
 
 
 # ============================================
 # LOAD ENVIRONMENT & CONFIGURE CLIENTS
 # ============================================
+@lru_cache(maxsize=1)
 def load_clients():
-    """Load and configure both Gemini and Groq clients."""
+    """Load and configure both Gemini and Groq clients (once per process; the pools are reused)."""
+    # SDK imports are deferred so importing this module (or using only one provider) stays cheap
+    from dotenv import load_dotenv
     load_dotenv()
 
     gemini_key = os.getenv("GEMINI_API_KEY")
@@ -24,13 +106,15 @@ def load_clients():
     groq_client = None
 
     if gemini_key:
+        import google.generativeai as genai
         genai.configure(api_key=gemini_key)
-        gemini_client = genai.GenerativeModel("gemini-2.5-flash-lite")
+        gemini_client = genai.GenerativeModel(GEMINI_MODEL_NAME, system_instruction=SUMMARY_INSTRUCTIONS)
         print("✅ Gemini client configured.")
     else:
         print("⚠️ Gemini API key not found.")
 
     if groq_key:
+        from groq import Groq
         groq_client = Groq(api_key=groq_key)
         print("✅ Groq client configured.")
     else:
@@ -42,6 +126,80 @@ def load_clients():
 # ============================================
 # EXTRACT REPOSITORY INFORMATION
 # ============================================
+def _stream_files_csv(columns: list, block_size: int):
+    """Yields non-empty record batches of the given FILES_CSV columns, parsed as strings."""
+    import pyarrow as pa
+    import pyarrow.csv as pa_csv
+
+    reader = pa_csv.open_csv(
+        FILES_CSV,
+        read_options=pa_csv.ReadOptions(block_size=block_size),
+        parse_options=pa_csv.ParseOptions(newlines_in_values=True),
+        convert_options=pa_csv.ConvertOptions(
+            include_columns=columns,
+            column_types={col: pa.string() for col in columns},
+            strings_can_be_null=False,
+        ),
+    )
+    for batch in reader:
+        if batch.num_rows:
+            yield batch
+
+
+def _scan_files_csv(block_size: int) -> tuple:
+    """One full scan of FILES_CSV in Arrow blocks of block_size bytes.
+
+    Returns (total_files, extension_counts, key_files, readme_row, sample_content).
+    """
+    import pyarrow.compute as pc
+
+    total_files = 0
+    extension_counts = Counter()
+    key_files = []
+    readme_row = None
+    sample_content = None
+
+    # Counting pass: file_content is tokenized but never converted to strings
+    for batch in _stream_files_csv(["file_name", "file_extension"], block_size):
+        row_offset = total_files
+        total_files += batch.num_rows
+        names = batch.column("file_name")
+
+        # Count file extensions
+        for entry in pc.value_counts(batch.column("file_extension")).to_pylist():
+            if entry["values"]:
+                extension_counts[entry["values"]] += entry["counts"]
+
+        # Identify key files (README, setup, config, etc.). "readme" is itself a key
+        # keyword, so the README is looked up among the (few) matches instead
+        # of scanning the name column a second time
+        if len(key_files) < 10 or readme_row is None:
+            key_mask = pc.match_substring_regex(names, KEY_FILE_RE.pattern, ignore_case=True)
+            key_index_array = pc.indices_nonzero(key_mask)
+            key_indices = key_index_array.to_pylist()
+            key_names = names.take(key_index_array).to_pylist()
+            key_files.extend(key_names[:10 - len(key_files)])
+
+            if readme_row is None:
+                for i, name in zip(key_indices, key_names):
+                    if "readme" in name.lower():
+                        readme_row = row_offset + i
+                        break
+
+    # Sample file content for context: the first README, else the first file.
+    # Only the batches up to that row are read, so the scan stops early.
+    if total_files:
+        target_row = readme_row if readme_row is not None else 0
+        row_offset = 0
+        for batch in _stream_files_csv(["file_content"], block_size):
+            if target_row < row_offset + batch.num_rows:
+                sample_content = batch.column("file_content")[target_row - row_offset].as_py()
+                break
+            row_offset += batch.num_rows
+
+    return total_files, extension_counts, key_files, readme_row, sample_content
+
+
 def extract_repo_info() -> dict:
     """Extracts key information from CSV files about the repository."""
     info = {
@@ -50,61 +208,59 @@ def extract_repo_info() -> dict:
         "total_issues": 0,
         "key_files": [],
         "programming_languages": set(),
-        "file_sample": ""
+        "file_sample": "",
+        "sample_issues": [],
     }
 
-    # Extract file information
+    # Extract file information: streaming passes through Arrow's C++ CSV reader
     if os.path.exists(FILES_CSV):
-        df_files = pd.read_csv(FILES_CSV, encoding="utf-8")
-        info["total_files"] = len(df_files)
-
-        # Count file extensions
-        extensions = df_files["file_extension"].value_counts()
-        info["file_types"] = extensions.to_dict()
-
-        # Identify key files (README, setup, config, etc.)
-        key_keywords = ["readme", "setup", "config", "main", "requirements", "dockerfile", "package.json"]
-        key_files = df_files[df_files["file_name"].str.lower().str.contains("|".join(key_keywords), na=False)]
-        info["key_files"] = key_files["file_name"].tolist()[:10]
-
-        # Detect programming languages by extension
-        lang_map = {
-            ".py": "Python",
-            ".js": "JavaScript",
-            ".ts": "TypeScript",
-            ".java": "Java",
-            ".cpp": "C++",
-            ".c": "C",
-            ".rb": "Ruby",
-            ".go": "Go",
-            ".rs": "Rust",
-            ".php": "PHP",
-            ".cs": "C#",
-            ".swift": "Swift",
-            ".kt": "Kotlin",
-        }
-
-        for ext, lang in lang_map.items():
-            if ext in info["file_types"]:
-                info["programming_languages"].add(lang)
-
-        # Sample file content for context
-        if len(df_files) > 0:
-            readme_files = df_files[df_files["file_name"].str.lower().str.contains("readme", na=False)]
-            if len(readme_files) > 0:
-                info["file_sample"] = readme_files.iloc[0]["file_content"][:1000]
-            else:
-                sample_row = df_files.iloc[0]
-                if pd.notna(sample_row["file_content"]) and len(str(sample_row["file_content"])) > 100:
-                    info["file_sample"] = str(sample_row["file_content"])[:1000]
+        import pyarrow as pa
+
+        extension_counts = Counter()
+        key_files = []
+        readme_row = None
+        sample_content = None
+
+        # With newlines_in_values, Arrow rejects a row larger than one block ("straddling
+        # object"), so the scan restarts with doubled blocks until the file fits in one
+        block_size = CSV_BLOCK_BYTES
+        file_size = os.path.getsize(FILES_CSV)
+        while True:
+            try:
+                info["total_files"], extension_counts, key_files, readme_row, sample_content = \
+                    _scan_files_csv(block_size)
+                break
+            except pa.ArrowInvalid as e:
+                if "straddling" in str(e) and block_size < file_size:
+                    block_size *= 2
+                    print(f"⚠️ A row in {FILES_CSV} spans a parse block; retrying with {block_size >> 20} MiB blocks")
+                    continue
+                print(f"⚠️ Could not parse {FILES_CSV}: {e}")
+                break
+
+        info["file_types"] = dict(extension_counts.most_common())
+        info["key_files"] = key_files
+
+        # Detect programming languages by extension: one set intersection over the distinct extensions
+        info["programming_languages"] = {LANG_MAP[ext] for ext in LANG_MAP.keys() & info["file_types"].keys()}
+
+        if readme_row is not None:
+            info["file_sample"] = (sample_content or "")[:1000]
+        elif sample_content and len(sample_content) > 100:
+            info["file_sample"] = sample_content[:1000]
 
     # Extract issues information
     if os.path.exists(ISSUES_CSV):
-        df_issues = pd.read_csv(ISSUES_CSV, encoding="utf-8")
-        info["total_issues"] = len(df_issues)
+        # One record per line (issues.py flattens bodies), so counting newlines counts issues
+        with open(ISSUES_CSV, "rb") as f:
+            newlines = sum(buf.count(b"\n") for buf in iter(lambda: f.read(1 << 20), b""))
+        info["total_issues"] = max(newlines - 1, 0)  # minus the header
 
-        # Sample issue titles
-        info["sample_issues"] = df_issues["title"].head(5).tolist() if "title" in df_issues.columns else []
+        # Sample issue titles (only the first rows are parsed)
+        with open(ISSUES_CSV, newline="", encoding="utf-8") as f:
+            reader = csv.DictReader(f)
+            if "title" in (reader.fieldnames or []):
+                info["sample_issues"] = [row["title"] for row in islice(reader, 5)]
 
     return info
 
@@ -112,6 +268,11 @@ def extract_repo_info() -> dict:
 # ============================================
 # BUILD CONTEXT FOR SUMMARIZATION
 # ============================================
+@lru_cache(maxsize=1)
+def _get_tokenizer():
+    return tiktoken.get_encoding(TOKEN_ENCODING)
+
+
 def build_summary_context(repo_info: dict) -> str:
     """Builds a structured context string for the AI to summarize."""
     languages = ", ".join(sorted(repo_info["programming_languages"])) if repo_info[
@@ -138,31 +299,170 @@ Repository Analysis Data:
 Sample File Content:
 {repo_info['file_sample'][:500]}
 """
+    # Cap the prompt size; the tail (sample file content) is what gets cut
+    enc = _get_tokenizer()
+    token_ids = enc.encode(context)
+    if len(token_ids) > CONTEXT_MAX_TOKENS:
+        context = enc.decode(token_ids[:CONTEXT_MAX_TOKENS])
     return context
 
 
 # ============================================
-# GENERATE SUMMARY WITH GEMINI
+# CACHE REPO INFO & CONTEXT
 # ============================================
-def generate_summary_gemini(gemini_client, context: str) -> str:
-    """Generates a repository summary using Gemini."""
-    prompt = f"""Based on the following repository analysis, provide a comprehensive yet concise summary of approximately 500 words. 
-Include:
-1. Project Overview - What is this project about?
-2. Technology Stack - What languages and frameworks are used?
-3. Structure - How is the codebase organized?
-4. Key Components - What are the main modules/files?
-5. Purpose & Functionality - What does this project do?
-6. Issues/Problems - What are users reporting/working on?
+def _csv_stamp() -> tuple:
+    """Modification times of the input CSVs (None for a missing file)."""
+    return tuple(os.stat(p).st_mtime_ns if os.path.exists(p) else None for p in (FILES_CSV, ISSUES_CSV))
+
+
+def load_repo_info_cached() -> tuple:
+    """Returns (repo_info, context), reusing the on-disk copy while both CSVs are unchanged."""
+    key = _csv_stamp()
+
+    if os.path.exists(REPO_INFO_CACHE):
+        try:
+            with open(REPO_INFO_CACHE, "rb") as f:
+                cached = pickle.load(f)
+            if cached.get("key") == key:
+                repo_info = cached["info"]
+                repo_info["programming_languages"] = set(repo_info["programming_languages"])
+                print("♻️ Using cached repository info.")
+                return repo_info, cached["context"]
+        except Exception as e:
+            print(f"⚠️ Ignoring unreadable repo info cache: {e}")
+
+    repo_info = extract_repo_info()
+    context = build_summary_context(repo_info)
+
+    payload = {
+        "key": key,
+        "info": {**repo_info, "programming_languages": sorted(repo_info["programming_languages"])},
+        "context": context,
+    }
+    os.makedirs(os.path.dirname(REPO_INFO_CACHE) or ".", exist_ok=True)
+    tmp_path = REPO_INFO_CACHE + ".tmp"
+    with open(tmp_path, "wb") as f:
+        pickle.dump(payload, f)
+    os.replace(tmp_path, REPO_INFO_CACHE)  # atomic: readers never see a half-written cache
+
+    return repo_info, context
+
+
+# ============================================
+# SEMANTIC SUMMARY CACHE
+# ============================================
+def _get_embed_model():
+    """The retriever's resident MiniLM model, so the process holds one copy."""
+    from models.gemini_models_rag import _get_embed_model as get_retriever_model
+    return get_retriever_model()
+
+
+def _files_csv_key():
+    """Cheap snapshot key for FILES_CSV (path, size, mtime), for callers without a commit SHA."""
+    if not os.path.exists(FILES_CSV):
+        return None
+    stat = os.stat(FILES_CSV)
+    return f"{os.path.abspath(FILES_CSV)}:{stat.st_size}:{stat.st_mtime_ns}"
+
+
+def _open_summary_cache():
+    os.makedirs(os.path.dirname(SUMMARY_CACHE_PATH) or ".", exist_ok=True)
+    conn = sqlite3.connect(SUMMARY_CACHE_PATH)
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS repo_summaries ("
+        "id INTEGER PRIMARY KEY, repo_key TEXT NOT NULL, model TEXT NOT NULL, "
+        "embedding BLOB NOT NULL, summary TEXT NOT NULL)"
+    )
+    conn.execute("CREATE INDEX IF NOT EXISTS repo_summaries_repo_key ON repo_summaries (repo_key)")
+    return conn
 
-Analysis Data:
-{context}
 
-Provide a well-structured, professional summary in exactly 500 words (±10 words):"""
+def embed_context(context: str) -> np.ndarray:
+    """Returns the normalized float32 embedding of a summary context."""
+    return _get_embed_model().encode([context], convert_to_numpy=True, normalize_embeddings=True)[0].astype("float32")
+
+
+def lookup_cached_summary(repo_key: str, context_vec: np.ndarray):
+    """Returns the stored summary of the most similar context, or None below the threshold.
+
+    Only summaries of the same repository snapshot (repo_key, e.g. "<url>@<sha>") are
+    candidates. Contexts share one template and the embedding model truncates before the
+    README sample, so across repositories a high similarity says little.
+    """
+    with closing(_open_summary_cache()) as conn, conn:
+        rows = conn.execute(
+            "SELECT embedding, summary, model FROM repo_summaries WHERE repo_key = ?", (repo_key,)
+        ).fetchall()
+    if not rows:
+        return None
+
+    # Flat inner-product search: vectors are normalized, so the dot product is the cosine
+    matrix = np.vstack([np.frombuffer(row[0], dtype="float32") for row in rows])
+    scores = matrix @ context_vec
+    best = int(np.argmax(scores))
+    if scores[best] < SUMMARY_CACHE_THRESHOLD:
+        return None
+
+    print(f"♻️ Reusing cached {rows[best][2]} summary (similarity {scores[best]:.3f})")
+    return rows[best][1]
+
+
+def store_cached_summary(repo_key: str, provider: str, context_vec: np.ndarray, summary: str):
+    """Adds a (context embedding, summary) pair to the repository's cache entries.
+
+    The model column records which provider won the race that produced the summary.
+    """
+    with closing(_open_summary_cache()) as conn, conn:
+        conn.execute(
+            "INSERT INTO repo_summaries (repo_key, model, embedding, summary) VALUES (?, ?, ?, ?)",
+            (repo_key, provider, context_vec.tobytes(), summary),
+        )
+
+
+# ============================================
+# RETRY LLM CALLS
+# ============================================
+async def _call_with_retry(make_call):
+    """Awaits make_call(cancelled) with a per-attempt timeout, retrying with exponential backoff.
+
+    Timing out does not stop an executor thread, so every attempt gets its own event, set once
+    the attempt is over; the streaming loops check it and abandon the response.
+    """
+    async for attempt in AsyncRetrying(stop=stop_after_attempt(SUMMARY_ATTEMPTS),
+                                       wait=wait_exponential(multiplier=1, max=8), reraise=True):
+        with attempt:
+            cancelled = threading.Event()
+            try:
+                return await asyncio.wait_for(make_call(cancelled), timeout=SUMMARY_TIMEOUT_SECONDS)
+            finally:
+                cancelled.set()
+
+
+# ============================================
+# GENERATE SUMMARY WITH GEMINI
+# ============================================
+def _stream_gemini(gemini_client, prompt: str, on_token, cancelled) -> str:
+    """Streams a Gemini completion, passing each part to on_token and joining them."""
+    parts = []
+    for chunk in gemini_client.generate_content(prompt, stream=True,
+                                                request_options={"timeout": SUMMARY_TIMEOUT_SECONDS}):
+        if cancelled.is_set():  # the attempt timed out or lost the race
+            break
+        if chunk.parts:  # the closing chunk may carry only the finish reason
+            parts.append(chunk.text)
+            if on_token:
+                on_token(chunk.text)
+    return "".join(parts)
+
+
+async def generate_summary_gemini(gemini_client, context: str, on_token=None) -> str:
+    """Generates a repository summary using Gemini."""
+    prompt = _PROMPT_TEMPLATE.format(context=context)
+    loop = asyncio.get_running_loop()
+    request = partial(_stream_gemini, gemini_client, prompt, on_token)
 
     try:
-        response = gemini_client.generate_content(prompt)
-        return response.text
+        return await _call_with_retry(lambda cancelled: loop.run_in_executor(_SUMMARY_EXECUTOR, request, cancelled))
     except Exception as e:
         print(f"❌ Gemini summarization failed: {e}")
         return None
@@ -171,93 +471,244 @@ Provide a well-structured, professional summary in exactly 500 words (±10 words
 # ============================================
 # GENERATE SUMMARY WITH GROQ
 # ============================================
-def generate_summary_groq(groq_client, context: str) -> str:
-    """Generates a repository summary using Groq."""
-    prompt = f"""Based on the following repository analysis, provide a comprehensive yet concise summary of approximately 500 words. 
-Include:
-1. Project Overview - What is this project about?
-2. Technology Stack - What languages and frameworks are used?
-3. Structure - How is the codebase organized?
-4. Key Components - What are the main modules/files?
-5. Purpose & Functionality - What does this project do?
-6. Issues/Problems - What are users reporting/working on?
+def _groq_chat_body(context: str) -> dict:
+    """Chat completion parameters for one summary, shared by the live and batch paths."""
+    return {
+        "model": GROQ_MODEL_NAME,
+        "messages": [
+            _SYS_MSG,
+            {"role": "user", "content": _PROMPT_TEMPLATE.format(context=context)}
+        ],
+        "temperature": 0.7,
+        "max_tokens": 1024,
+    }
 
-Analysis Data:
-{context}
 
-Provide a well-structured, professional summary in exactly 500 words (±10 words):"""
+def _stream_groq(groq_client, context: str, on_token, cancelled) -> str:
+    """Streams a Groq completion, passing each delta to on_token and joining them."""
+    parts = []
+    with groq_client.chat.completions.create(**_groq_chat_body(context), stream=True,
+                                             timeout=SUMMARY_TIMEOUT_SECONDS) as stream:
+        for chunk in stream:
+            if cancelled.is_set():  # the attempt timed out or lost the race; closing drops the connection
+                break
+            if chunk.choices and chunk.choices[0].delta.content:
+                parts.append(chunk.choices[0].delta.content)
+                if on_token:
+                    on_token(chunk.choices[0].delta.content)
+    return "".join(parts)
+
+
+async def generate_summary_groq(groq_client, context: str, on_token=None) -> str:
+    """Generates a repository summary using Groq."""
+    loop = asyncio.get_running_loop()
+    request = partial(_stream_groq, groq_client, context, on_token)
 
     try:
-        response = groq_client.chat.completions.create(
-            model="openai/gpt-oss-120b",
-            messages=[
-                {"role": "system",
-                 "content": "You are an expert software engineer who provides clear, concise technical summaries."},
-                {"role": "user", "content": prompt}
-            ],
-            temperature=0.7,
-            max_tokens=1024
-        )
-        return response.choices[0].message.content
+        return await _call_with_retry(lambda cancelled: loop.run_in_executor(_SUMMARY_EXECUTOR, request, cancelled))
     except Exception as e:
         print(f"❌ Groq summarization failed: {e}")
         return None
 
 
+def generate_summaries_groq_batch(groq_client, contexts: list) -> list:
+    """Summarizes many contexts as one Groq batch job; returns summaries in input order (None on failure)."""
+    summaries = [None] * len(contexts)
+    lines = [
+        json.dumps({"custom_id": str(i), "method": "POST", "url": "/v1/chat/completions",
+                    "body": _groq_chat_body(context)})
+        for i, context in enumerate(contexts)
+    ]
+
+    try:
+        batch_file = groq_client.files.create(file=("summaries.jsonl", "\n".join(lines).encode("utf-8")),
+                                              purpose="batch")
+        batch = groq_client.batches.create(input_file_id=batch_file.id, endpoint="/v1/chat/completions",
+                                           completion_window="24h")
+        print(f"📦 Submitted Groq batch {batch.id} with {len(contexts)} summaries")
+
+        while batch.status not in ("completed", "failed", "expired", "cancelled"):
+            time.sleep(BATCH_POLL_SECONDS)
+            batch = groq_client.batches.retrieve(batch.id)
+
+        if batch.status != "completed" or not batch.output_file_id:
+            print(f"❌ Groq batch {batch.id} ended with status {batch.status}")
+            return summaries
+
+        output = groq_client.files.content(batch.output_file_id).read().decode("utf-8")
+    except Exception as e:
+        print(f"❌ Groq batch summarization failed: {e}")
+        return summaries
+
+    # A malformed result line only loses its own summary ("" when its custom_id is readable),
+    # not the rest of the finished batch
+    for line in output.splitlines():
+        index = None
+        try:
+            result = json.loads(line)
+            index = int(result["custom_id"])
+            response = result.get("response") or {}
+            if response.get("status_code") == 200:
+                summaries[index] = response["body"]["choices"][0]["message"]["content"] or ""
+        except (ValueError, KeyError, IndexError, TypeError, AttributeError) as e:
+            print(f"⚠️ Skipping malformed Groq batch result: {e}")
+            if index is not None and 0 <= index < len(summaries):
+                summaries[index] = ""
+
+    return summaries
+
+
 # ============================================
-# MAIN SUMMARIZATION FUNCTION
+# RACE PROVIDERS
 # ============================================
-def summarize_repository(model: str = "gemini") -> str:
-    """Main function to summarize a repository using the specified model."""
-    print(f"🔍 Analyzing repository for summarization (using {model})...")
+async def race_summaries(gemini_client, groq_client, context: str, on_token=None) -> tuple:
+    """Queries every available provider at once; returns (provider, summary) of the first success.
+
+    With on_token, the first provider to produce text claims the stream: only its tokens are
+    forwarded (from a worker thread), and its summary is preferred unless it fails.
+    """
+    owner = []
+    closed = threading.Event()
+    owner_lock = threading.Lock()
+
+    def forward_from(provider):
+        if on_token is None:
+            return None
+
+        def forward(text):
+            with owner_lock:
+                if not owner:
+                    owner.append(provider)
+            if owner[0] == provider and not closed.is_set():
+                on_token(text)
+        return forward
+
+    tasks = {}
+    if gemini_client:
+        tasks[asyncio.create_task(generate_summary_gemini(gemini_client, context, forward_from("gemini")))] = "gemini"
+    if groq_client:
+        tasks[asyncio.create_task(generate_summary_groq(groq_client, context, forward_from("groq")))] = "groq"
 
-    # Load clients
-    gemini_client, groq_client = load_clients()
+    try:
+        pending = set(tasks)
+        results = {}
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.result():
+                    results[tasks[task]] = task.result()
+            # The streaming provider wins once it finishes; until then others wait behind it
+            if owner and owner[0] in results:
+                return owner[0], results[owner[0]]
+            if results and not (owner and owner[0] in {tasks[t] for t in pending}):
+                provider = next(iter(results))
+                return provider, results[provider]
+            # A provider that failed every attempt drops out; keep waiting on the rest
+        return None, None
+    finally:
+        closed.set()
+        for task in tasks:
+            task.cancel()
 
-    # Validate model and client availability
-    if model == "gemini" and not gemini_client:
-        print("⚠️ Gemini client not available. Falling back to Groq...")
-        model = "groq"
 
-    if model == "groq" and not groq_client:
-        print("⚠️ Groq client not available. Falling back to Gemini...")
-        model = "gemini"
+# ============================================
+# MAIN SUMMARIZATION FUNCTION
+# ============================================
+def summarize_repository(model: str = "gemini", on_token=None, repo_key: str = None) -> str:
+    """Main function to summarize a repository.
 
-    if not gemini_client and not groq_client:
+    Every configured provider is queried and the first successful summary wins, so
+    `model` no longer selects one; it is accepted for compatibility with existing callers.
+    on_token receives the summary text as it streams (not called for cached summaries).
+    repo_key identifies the repository snapshot for the summary cache (e.g. "<url>@<sha>");
+    without one, the files CSV's size and mtime stand in.
+    """
+    print("🔍 Analyzing repository for summarization...")
+
+    # Load clients
+    gemini_client, groq_client = load_clients()
+    providers = [name for name, client in (("gemini", gemini_client), ("groq", groq_client)) if client]
+    if not providers:
         raise RuntimeError("❌ No AI clients available. Please check API keys.")
 
-    # Extract repository information
-    repo_info = extract_repo_info()
+    # Extract repository information & build context (cached while the CSVs are unchanged)
+    repo_info, context = load_repo_info_cached()
     print(f"✅ Extracted repo info: {repo_info['total_files']} files, {repo_info['total_issues']} issues")
-
-    # Build context
-    context = build_summary_context(repo_info)
     print("📝 Building summarization context...")
 
-    # Generate summary
-    print(f"🤖 Generating summary with {model}...")
+    # Same repository snapshot with a near-identical context (e.g. a few issues changed)
+    # reuses the earlier summary; no files, no snapshot key, no cache
+    repo_key = repo_key or _files_csv_key()
+    context_vec = embed_context(context) if repo_key else None
+    if repo_key:
+        summary = lookup_cached_summary(repo_key, context_vec)
+        if summary:
+            return summary
 
-    if model == "gemini":
-        summary = generate_summary_gemini(gemini_client, context)
-    else:
-        summary = generate_summary_groq(groq_client, context)
+    # Generate summary: both providers race, so a slow or failing one no longer adds latency
+    print(f"🤖 Generating summary (racing {', '.join(providers)})...")
+    provider, summary = asyncio.run(race_summaries(gemini_client, groq_client, context, on_token))
 
     if not summary:
-        raise RuntimeError(f"❌ Failed to generate summary with {model}")
+        raise RuntimeError(f"❌ Failed to generate summary with {' or '.join(providers)}")
 
-    print(f"✅ Summary generated ({len(summary.split())} words)")
+    if repo_key:
+        store_cached_summary(repo_key, provider, context_vec, summary)
+    print(f"✅ Summary generated by {provider} ({len(summary.split())} words)")
     return summary
 
 
+# ============================================
+# BATCH SUMMARIZATION
+# ============================================
+def summarize_repositories_batch(contexts: list) -> list:
+    """Summarizes several repositories from their build_summary_context strings, in input order."""
+    gemini_client, groq_client = load_clients()
+    if not gemini_client and not groq_client:
+        raise RuntimeError("❌ No AI clients available. Please check API keys.")
+
+    if groq_client and len(contexts) >= BATCH_MIN_REPOS:
+        return generate_summaries_groq_batch(groq_client, contexts)
+
+    # Small runs stay on the live path: every context races both providers concurrently.
+    # Without Groq any number of contexts can land here, so at most BATCH_MIN_REPOS - 1
+    # races run at once to keep within the executor's workers
+    async def race_all():
+        slots = asyncio.Semaphore(BATCH_MIN_REPOS - 1)
+
+        async def race_one(context):
+            async with slots:
+                return await race_summaries(gemini_client, groq_client, context)
+
+        return await asyncio.gather(*(race_one(c) for c in contexts))
+
+    return [summary for _, summary in asyncio.run(race_all())]
+
+
 # ============================================
 # EXAMPLE USAGE
 # ============================================
 if __name__ == "__main__":
+    streamed = []
+
+    def show_token(text):
+        if not streamed:
+            print("\n" + "=" * 80)
+            print("REPOSITORY SUMMARY")
+            print("=" * 80)
+        streamed.append(text)
+        print(text, end="", flush=True)
+
     try:
-        summary = summarize_repository(model="gemini")
-        print("\n" + "=" * 80)
-        print("REPOSITORY SUMMARY")
-        print("=" * 80)
-        print(summary)
+        summary = summarize_repository(model="gemini", on_token=show_token)
+        # Cached summaries are not streamed, and a stream cut short by a failed attempt
+        # is replaced by the summary that was actually returned
+        if "".join(streamed) != summary:
+            print("\n" + "=" * 80)
+            print("REPOSITORY SUMMARY")
+            print("=" * 80)
+            print(summary)
+        else:
+            print()
     except Exception as e:
         print(f"Error: {e}")
\ No newline at end of file